@@ -1,8 +1,15 @@
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Flask, render_template, jsonify, request, send_from_directory, abort
+from werkzeug.security import safe_join
 import os
-import json
 import uuid
-from datetime import datetime
+
+from file_manager import FileManager
+from project_repository import VersionConflict
+from audio_transcoder import AudioTranscoder
+from image_variants import ImageVariantPipeline
+from export_jobs import ExportQueue
+from upload_stream import UploadRequest, DEFAULT_UPLOAD_LIMITS
+from audio_dispatcher import AudioDispatcher
 
 # 自動選擇檢測器
 try:
@@ -15,12 +22,29 @@ except:
     print("✓ 使用標準檢測器")
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['PROJECTS_FOLDER'] = 'projects'
 
+# 上傳大小上限：各類型分別限制，整個請求另加表單欄位的餘裕
+app.config['UPLOAD_LIMITS'] = dict(DEFAULT_UPLOAD_LIMITS)
+app.config['MAX_CONTENT_LENGTH'] = max(app.config['UPLOAD_LIMITS'].values()) + 1024 * 1024
+
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['PROJECTS_FOLDER'], exist_ok=True)
 
+file_manager = FileManager(app.config['PROJECTS_FOLDER'])
+app.config['UPLOAD_TEMP_FOLDER'] = file_manager.assets.tmp_folder
+audio_transcoder = AudioTranscoder()
+image_pipeline = ImageVariantPipeline()
+export_queue = ExportQueue(file_manager)
+
+# 觸碰音效直接由伺服器播放，不經過瀏覽器
+# 伺服器播放由部署設定決定 (TOUCHHEAR_SERVER_AUDIO=0 關閉)，不受個別瀏覽器的播放模式影響
+app.config['SERVER_AUDIO'] = os.environ.get('TOUCHHEAR_SERVER_AUDIO', '1') != '0'
+audio_dispatcher = AudioDispatcher()
+detector.add_touch_listener(audio_dispatcher.submit)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -41,90 +65,292 @@ def video_feed():
 def detection_status():
     return jsonify(detector.get_detection_results())
 
+@app.route('/api/detection-stream')
+def detection_stream():
+    touch_only = request.args.get('events') == 'touch'
+    return detector.get_event_stream(touch_only)
+
+@app.route('/api/touch-events')
+def touch_events():
+    since = request.args.get('since', 0, type=int)
+    return jsonify(detector.get_touch_events(since))
+
 # 專案相關 API
 @app.route('/api/projects', methods=['GET', 'POST'])
 def api_projects():
     if request.method == 'GET':
-        projects = []
-        if os.path.exists(app.config['PROJECTS_FOLDER']):
-            for folder in os.listdir(app.config['PROJECTS_FOLDER']):
-                config_path = os.path.join(app.config['PROJECTS_FOLDER'], folder, 'config.json')
-                if os.path.exists(config_path):
-                    with open(config_path, 'r', encoding='utf-8') as f:
-                        project = json.load(f)
-                        project['id'] = folder
-                        projects.append(project)
-        return jsonify(projects)
-    else:
-        data = request.get_json()
-        project_id = str(uuid.uuid4())[:8]
-        project_path = os.path.join(app.config['PROJECTS_FOLDER'], project_id)
-        os.makedirs(project_path, exist_ok=True)
+        # 未指定分頁參數時維持舊格式 (完整設定的陣列)
+        if not any(key in request.args for key in ('limit', 'cursor', 'sort', 'fields')):
+            projects = file_manager.list_projects()
+            for project in projects:
+                project['id'] = project.pop('folder_name')
+            return jsonify(projects)
         
-        project = {
-            'name': data['name'],
-            'created_at': datetime.now().isoformat(),
-            'background_image': None,
-            'rois': []
-        }
+        sort = request.args.get('sort', 'created')
+        fields = request.args.get('fields', 'summary')
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+        if sort not in ('created', 'modified') or fields not in ('summary', 'full'):
+            return jsonify({'error': '無效的 sort 或 fields'}), 400
         
-        with open(os.path.join(project_path, 'config.json'), 'w', encoding='utf-8') as f:
-            json.dump(project, f, ensure_ascii=False, indent=2)
+        try:
+            projects, next_cursor = file_manager.repository.list_summaries(
+                sort, limit, request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'error': '無效的 cursor'}), 400
         
-        project['id'] = project_id
+        if fields == 'full':
+            projects = [dict(file_manager.repository.get(p['id']) or {}, id=p['id']) for p in projects]
+        return jsonify({'projects': projects, 'next_cursor': next_cursor})
+    else:
+        data = request.get_json()
+        project = file_manager.create_project(data['name'], project_id=str(uuid.uuid4())[:8])
+        project['id'] = project.pop('folder_name')
         return jsonify(project)
 
+@app.route('/api/search')
+def search_projects():
+    """搜尋專案名稱、ROI 名稱、音效檔名與日期 (例如 2025-09)"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '缺少 q'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+    return jsonify({'query': query, 'results': file_manager.search(query, limit)})
+
 
 @app.route('/api/projects/<project_id>/upload', methods=['POST'])
 def upload_background(project_id):
     file = request.files.get('image')
     if file:
-        filename = f"bg_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file.filename.split('.')[-1]}"
-        project_path = os.path.join(app.config['PROJECTS_FOLDER'], project_id)
-        file_path = os.path.join(project_path, filename)
-        file.save(file_path)
+        if not file_manager.repository.exists(project_id):
+            return jsonify({'error': '專案不存在'}), 404
+        
+        filename = file_manager.save_uploaded_file(file, project_id, kind='image')
+        if not filename:
+            return jsonify({'error': '不支援的圖片格式'}), 415
         
         # 更新專案配置
-        config_path = os.path.join(project_path, 'config.json')
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        config['background_image'] = filename
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        file_manager.repository.update_project(project_id, {'background_image': filename, 'background_variants': {}})
         
-        return jsonify({'filename': filename, 'success': True})
+        # 背景產生縮圖/預覽/列印版本，完成後記錄於專案 (期間背景已被替換則略過)
+        def on_processed(variants):
+            current = file_manager.repository.get(project_id)
+            if current and current.get('background_image') == filename:
+                file_manager.repository.update_project(
+                    project_id, {'background_variants': variants}, bump_version=False)
+        
+        image_pipeline.submit(os.path.join(app.config['PROJECTS_FOLDER'], project_id), filename, on_processed)
+        
+        version = file_manager.load_project(project_id).get('version')
+        return jsonify({'filename': filename, 'version': version, 'success': True})
     
     return jsonify({'error': '無檔案'}), 400
 
-@app.route('/api/projects/<project_id>/rois', methods=['POST'])
-def add_roi(project_id):
+@app.route('/api/projects/<project_id>')
+def get_project(project_id):
+    project = file_manager.load_project(project_id)
+    if project is None:
+        return jsonify({'error': '專案不存在'}), 404
+    project['id'] = project.pop('folder_name')
+    return jsonify(project)
+
+@app.route('/api/projects/<project_id>', methods=['DELETE'])
+def delete_project(project_id):
+    if not file_manager.repository.exists(project_id):
+        return jsonify({'error': '專案不存在'}), 404
+    if not file_manager.delete_project(project_id):
+        return jsonify({'error': '刪除失敗'}), 500
+    return jsonify({'success': True})
+
+@app.route('/api/projects/<project_id>/rois', methods=['PATCH'])
+def batch_rois(project_id):
+    """批次套用 ROI 操作；版本不符時回傳 409，編輯器需重新載入"""
     data = request.get_json()
-    config_path = os.path.join(app.config['PROJECTS_FOLDER'], project_id, 'config.json')
+    if not data or not isinstance(data.get('ops'), list) or not isinstance(data.get('version'), int):
+        return jsonify({'error': '缺少 version 或 ops'}), 400
     
-    with open(config_path, 'r', encoding='utf-8') as f:
-        config = json.load(f)
+    try:
+        result = file_manager.apply_roi_ops(project_id, data['version'], data['ops'])
+    except VersionConflict as e:
+        return jsonify({'error': '專案已被其他人修改', 'version': e.current_version}), 409
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'無效的操作: {e}'}), 400
     
-    roi = {
-        'id': str(uuid.uuid4()),
-        'name': data['name'],
-        'type': data['type'],
-        'x': data['x'],
-        'y': data['y'],
-        'width': data.get('width'),
-        'height': data.get('height'),
-        'audio_file': None
-    }
+    if result is None:
+        return jsonify({'error': '專案不存在'}), 404
     
-    config['rois'].append(roi)
+    version, created = result
+    return jsonify({'version': version, 'created': created, 'success': True})
+
+@app.route('/api/projects/<project_id>/rois', methods=['POST'])
+def add_roi(project_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '缺少 ROI 資料'}), 400
+    if not file_manager.repository.exists(project_id):
+        return jsonify({'error': '專案不存在'}), 404
     
-    with open(config_path, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=2)
+    try:
+        roi = file_manager.add_roi(project_id, data)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'無效的 ROI: {e}'}), 400
+    if roi is None:
+        return jsonify({'error': '專案不存在'}), 404
     
     return jsonify(roi)
 
-@app.route('/projects/<project_id>/<filename>')
+@app.route('/api/projects/<project_id>/upload-audio', methods=['POST'])
+def upload_audio(project_id):
+    file = request.files.get('audio')
+    roi_id = request.form.get('roi_id')
+    if not file or not roi_id:
+        return jsonify({'error': '無檔案'}), 400
+    if not file_manager.repository.exists(project_id):
+        return jsonify({'error': '專案不存在'}), 404
+    
+    filename = file_manager.save_uploaded_file(file, project_id, kind='audio')
+    if not filename:
+        return jsonify({'error': '不支援的音效格式'}), 415
+    roi = file_manager.update_roi(project_id, roi_id,
+                                  {'audio_file': filename, 'audio_name': file.filename, 'audio_pcm': None})
+    if roi is None:
+        return jsonify({'error': 'ROI 不存在'}), 404
+    
+    # 背景轉為標準 PCM，完成後記錄於 ROI (期間音效已被替換則略過)
+    def on_transcoded(pcm_name):
+        project = file_manager.load_project(project_id)
+        current = next((r for r in project['rois'] if r['id'] == roi_id), None) if project else None
+        if current and current.get('audio_file') == filename:
+            file_manager.update_roi(project_id, roi_id, {'audio_pcm': pcm_name}, bump_version=False)
+    
+    project_path = os.path.join(app.config['PROJECTS_FOLDER'], project_id)
+    audio_transcoder.submit(project_path, filename, on_transcoded)
+    
+    version = file_manager.load_project(project_id).get('version')
+    return jsonify({'filename': filename, 'version': version, 'success': True})
+
+@app.route('/api/projects/<project_id>/activate', methods=['POST'])
+def activate_project(project_id):
+    project_path = os.path.join(app.config['PROJECTS_FOLDER'], project_id)
+    if not file_manager.repository.exists(project_id):
+        return jsonify({'error': '專案不存在'}), 404
+    
+    # 檢測器與音效派送直接讀取 config.json，先寫入延遲中的變更
+    file_manager.repository.publish(project_id)
+    
+    # 由檢測器在每一幀解析 ROI 觸碰
+    detector.set_active_project(project_id, project_path)
+    
+    # 伺服器播放是全域狀態，只依部署設定切換；瀏覽器播放模式的頁面不會關閉伺服器音效
+    server_audio = app.config['SERVER_AUDIO']
+    if server_audio:
+        audio_dispatcher.set_project(project_id, project_path)
+    else:
+        audio_dispatcher.set_project(None, None)
+    return jsonify({'project_id': project_id, 'server_audio': server_audio, 'success': True})
+
+@app.route('/api/projects/<project_id>/audio-manifest')
+def audio_manifest(project_id):
+    project = file_manager.load_project(project_id)
+    if project is None:
+        return jsonify({'error': '專案不存在'}), 404
+    
+    # 瀏覽器自行解碼，使用原始 (壓縮) 檔案以減少下載量
+    clips = [{
+        'roi_id': roi['id'],
+        'name': roi.get('name'),
+        'url': f"/projects/{project_id}/{roi['audio_file']}",
+        'priority': roi.get('priority', 0),
+        'group': roi.get('group'),
+        'retrigger': roi.get('retrigger', 'restart'),
+        'volume': roi.get('volume', 1.0),
+        'cooldown': roi.get('cooldown', 0)
+    } for roi in project.get('rois', []) if roi.get('audio_file')]
+    
+    return jsonify({'project_id': project_id, 'clips': clips})
+
+# 音效相關 API
+@app.route('/api/play-audio', methods=['POST'])
+def play_audio():
+    data = request.get_json()
+    if not data or not data.get('roi_id'):
+        return jsonify({'error': '缺少 ROI'}), 400
+    audio_dispatcher.play_roi(data['roi_id'])
+    return jsonify({'success': True})
+
+@app.route('/api/set-volume', methods=['POST'])
+def set_volume():
+    data = request.get_json(silent=True) or {}
+    try:
+        volume = float(data.get('volume', 1.0))
+    except (TypeError, ValueError):
+        return jsonify({'error': '無效的音量'}), 400
+    audio_dispatcher.set_volume(volume)
+    return jsonify({'success': True})
+
+@app.route('/api/stop-audio', methods=['POST'])
+def stop_audio():
+    audio_dispatcher.stop_all()
+    return jsonify({'success': True})
+
+@app.route('/api/audio-status')
+def audio_status():
+    return jsonify(audio_dispatcher.get_status())
+
+def export_job_response(job):
+    if job['status'] == 'done':
+        job['download_url'] = f"/projects/{job['project_id']}/{job['filename']}"
+    return jsonify(job)
+
+@app.route('/api/projects/<project_id>/export', methods=['POST'])
+def export_project(project_id):
+    """建立匯出工作並立即回傳工作 ID，以 /api/export-jobs/<job_id> 查詢進度"""
+    data = request.get_json(silent=True) or {}
+    try:
+        width = min(max(int(data.get('width', 800)), 1), 4096)
+        height = min(max(int(data.get('height', 600)), 1), 4096)
+    except (TypeError, ValueError):
+        return jsonify({'error': '無效的尺寸'}), 400
+    
+    job = export_queue.submit(project_id, width, height)
+    if job is None:
+        return jsonify({'error': '專案不存在'}), 404
+    return export_job_response(job), 200 if job['status'] == 'done' else 202
+
+@app.route('/api/export-jobs/<job_id>')
+def export_job_status(job_id):
+    job = export_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': '工作不存在'}), 404
+    return export_job_response(job)
+
+@app.route('/api/projects/<project_id>/assets')
+def project_assets(project_id):
+    assets = file_manager.list_assets(project_id)
+    if assets is None:
+        return jsonify({'error': '專案不存在'}), 404
+    
+    for asset in assets:
+        asset['url'] = f"/projects/{project_id}/{asset['path']}"
+    return jsonify({'project_id': project_id, 'assets': assets})
+
+@app.route('/projects/<project_id>/<path:filename>')
 def project_file(project_id, filename):
-    return send_from_directory(os.path.join(app.config['PROJECTS_FOLDER'], project_id), filename)
+    project_path = os.path.join(app.config['PROJECTS_FOLDER'], project_id)
+    file_path = safe_join(project_path, filename)
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+    
+    # 以內容雜湊作為強 ETag；conditional 同時處理 If-None-Match 與 Range
+    immutable = file_manager.is_hashed_name(filename)
+    response = send_from_directory(project_path, filename, conditional=True,
+                                   etag=file_manager.file_digest(file_path),
+                                   max_age=31536000 if immutable else None)
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
 
 if __name__ == '__main__':
     print("TouchHear 系統啟動: http://localhost:5000")
@@ -0,0 +1,112 @@
+# asset_store.py - 內容定址素材儲存模組
+import json
+import os
+import shutil
+import threading
+import time
+
+from audio_transcoder import file_hash
+from project_repository import ProjectRepository
+
+ASSET_FOLDER = '.assets'
+REFS_FILENAME = 'refs.json'
+
+# 暫存檔超過此時間 (秒) 未寫入即視為中斷的上傳
+STALE_TEMP_SECONDS = 3600
+
+
+class AssetStore:
+    """以內容雜湊儲存上傳素材，相同內容只存一份
+
+    素材存放於 projects/.assets/<雜湊前兩碼>/<雜湊><副檔名>，專案資料夾內以
+    硬連結 (不支援時複製) 提供同名檔案，因此既有以專案路徑讀檔的程式不需修改。
+    每個素材記錄引用的專案，刪除專案時引用歸零的素材一併移除。
+    """
+
+    def __init__(self, projects_folder):
+        self.root = os.path.join(projects_folder, ASSET_FOLDER)
+        self.tmp_folder = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._refs = self._read_refs()  # 素材名稱 -> [專案 ID]
+        self.remove_stale_temp()
+
+    def remove_stale_temp(self, max_age=STALE_TEMP_SECONDS):
+        """刪除中斷的上傳留下的暫存檔 (其他行程仍在寫入的檔案不受影響)，回傳刪除的數量"""
+        removed = 0
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.tmp_folder):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                print(f"Error removing temp file {entry.name}: {e}")
+        return removed
+
+    def _read_refs(self):
+        try:
+            with open(os.path.join(self.root, REFS_FILENAME), 'r', encoding='utf-8') as f:
+                return {name: set(projects) for name, projects in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def _write_refs(self):
+        data = json.dumps({name: sorted(projects) for name, projects in self._refs.items()})
+        ProjectRepository._write_atomic(os.path.join(self.root, REFS_FILENAME), data)
+
+    def blob_path(self, name):
+        return os.path.join(self.root, name[:2], name)
+
+    def temp_path(self):
+        """上傳暫存檔路徑 (與素材同一檔案系統，之後可直接 rename)"""
+        return os.path.join(self.tmp_folder, f"{os.getpid()}_{threading.get_ident()}_{os.urandom(4).hex()}.tmp")
+
+    def add(self, temp_path, project_path, ext, digest=None):
+        """將暫存檔納入素材庫並連結到專案資料夾，回傳專案內的檔名 (<雜湊><副檔名>)"""
+        name = f"{digest or file_hash(temp_path)}{ext.lower()}"
+        project_id = os.path.basename(os.path.normpath(project_path))
+        blob_path = self.blob_path(name)
+
+        with self._lock:
+            if os.path.exists(blob_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(temp_path, blob_path)
+
+            target = os.path.join(project_path, name)
+            if not os.path.exists(target):
+                try:
+                    os.link(blob_path, target)
+                except OSError:
+                    shutil.copyfile(blob_path, target)
+
+            projects = self._refs.setdefault(name, set())
+            if project_id not in projects:
+                projects.add(project_id)
+                self._write_refs()
+        return name
+
+    def ref_count(self, name):
+        with self._lock:
+            return len(self._refs.get(name, ()))
+
+    def release_project(self, project_id):
+        """移除專案的所有引用，刪除已無引用的素材，回傳釋放的位元組數"""
+        freed = 0
+        with self._lock:
+            for name in [name for name, projects in self._refs.items() if project_id in projects]:
+                projects = self._refs[name]
+                projects.discard(project_id)
+                if projects:
+                    continue
+                del self._refs[name]
+                try:
+                    blob_path = self.blob_path(name)
+                    freed += os.path.getsize(blob_path)
+                    os.remove(blob_path)
+                except OSError as e:
+                    print(f"Error removing asset {name}: {e}")
+            self._write_refs()
+        return freed
@@ -0,0 +1,154 @@
+# audio_benchmark.py - 音效延遲測試工具
+#
+# 以 SDL 的 disk 音效驅動程式將混音結果寫入檔案 (不需要音效卡)，
+# 依腳本時間觸發 AudioManager，再從輸出檔找出每次觸發的第一個取樣，
+# 計算觸發到出聲的延遲、抖動與遺失的觸發。
+#
+#   python audio_benchmark.py --buffer 256 --triggers 40 --interval 0.2
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+def make_click(frequency, channels, duration=0.02, amplitude=0.8):
+    """產生測試用的短促方波 (起音明確，便於偵測)"""
+    frames = int(frequency * duration)
+    t = np.arange(frames) / frequency
+    wave = np.sign(np.sin(2 * np.pi * 1000 * t)) * amplitude
+    samples = np.repeat(wave[:, None], channels, axis=1)
+    return (samples * 32767).astype('<i2')
+
+
+def find_onsets(samples, frequency, threshold=0.1, min_gap=0.05):
+    """找出輸出中每段聲音的起點 (取樣索引)"""
+    loud = np.flatnonzero(np.abs(samples).max(axis=1) > threshold * 32767)
+    if len(loud) == 0:
+        return []
+    gap = int(frequency * min_gap)
+    starts = loud[np.concatenate(([True], np.diff(loud) > gap))]
+    return starts.tolist()
+
+
+def output_clock(clock_samples):
+    """以線性迴歸估計輸出時鐘 (取樣/秒, 起點)，消除檔案緩衝造成的階梯"""
+    t, frames = np.array(clock_samples).T
+    slope, intercept = np.polyfit(t, frames, 1)
+    return float(slope), float(intercept)
+
+
+def match_triggers(trigger_times, onsets, frequency, max_latency=0.5):
+    """將觸發時間對應到輸出起點，回傳每次觸發的延遲 (秒)，遺失為 None"""
+    latencies = []
+    onset_times = [onset / frequency for onset in onsets]
+    i = 0
+    for trigger_time in trigger_times:
+        while i < len(onset_times) and onset_times[i] < trigger_time:
+            i += 1
+        if i < len(onset_times) and onset_times[i] - trigger_time <= max_latency:
+            latencies.append(onset_times[i] - trigger_time)
+            i += 1
+        else:
+            latencies.append(None)
+    return latencies
+
+
+def summarize(latencies):
+    """延遲統計 (毫秒)"""
+    measured = np.array([l for l in latencies if l is not None]) * 1000
+    report = {
+        "triggers": len(latencies),
+        "dropped": len(latencies) - len(measured),
+    }
+    if len(measured):
+        report.update({
+            "latency_avg_ms": float(measured.mean()),
+            "latency_min_ms": float(measured.min()),
+            "latency_p95_ms": float(np.percentile(measured, 95)),
+            "latency_max_ms": float(measured.max()),
+            "jitter_ms": float(measured.std()),
+        })
+    return report
+
+
+def run_benchmark(buffer=256, num_channels=16, triggers=40, interval=0.2, warmup=0.5, output_file=None):
+    """執行一次測試並回傳報告"""
+    output_file = output_file or os.path.join(tempfile.gettempdir(), 'touchhear_audio_benchmark.raw')
+    # disk 驅動程式需在混音器初始化前設定
+    os.environ['SDL_AUDIODRIVER'] = 'disk'
+    os.environ['SDL_DISKAUDIOFILE'] = output_file
+
+    import pygame
+    from audio_manager import AudioManager
+
+    manager = AudioManager(buffer=buffer, num_channels=num_channels)
+    opened_at = time.perf_counter()  # 輸出檔的第 0 個取樣
+
+    frequency, _, channels = pygame.mixer.get_init()
+    click_path = 'benchmark_click'
+    manager.audio_cache.put(click_path, pygame.mixer.Sound(buffer=make_click(frequency, channels).tobytes()))
+
+    # 依腳本時間觸發，等待期間記錄輸出檔寫入進度作為輸出時鐘
+    frame_bytes = channels * 2
+    clock_samples = []
+    trigger_times = []
+    start = opened_at + warmup
+    for n in range(triggers + 1):
+        target = start + n * interval
+        while time.perf_counter() < target:
+            clock_samples.append((time.perf_counter() - opened_at, os.path.getsize(output_file) / frame_bytes))
+            time.sleep(0.001)
+        if n < triggers:
+            trigger_times.append(time.perf_counter() - opened_at)
+            manager.play_audio(click_path, roi_id=f"benchmark_{n}")
+
+    time.sleep(0.5)
+    stats = manager.get_latency_stats()
+    pygame.mixer.quit()
+
+    samples = np.fromfile(output_file, dtype='<i2')
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+
+    # disk 驅動程式的輸出速度與實際時間有偏差，觸發時間換算為輸出時鐘上的位置
+    output_rate, output_start = output_clock(clock_samples)
+    trigger_positions = [(output_start + output_rate * t) / frequency for t in trigger_times]
+    latencies = match_triggers(trigger_positions, find_onsets(samples, frequency), frequency)
+
+    report = summarize(latencies)
+    report.update({
+        "buffer": buffer,
+        "num_channels": num_channels,
+        "interval_s": interval,
+        "output_rate": output_rate,
+        "device_buffer_ms": stats["device_buffer_ms"],
+        "call_avg_ms": stats["call_avg_ms"],
+        "call_max_ms": stats["call_max_ms"],
+    })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TouchHear 音效延遲測試')
+    parser.add_argument('--buffer', type=int, default=256, help='混音器緩衝區大小 (取樣數)')
+    parser.add_argument('--num-channels', type=int, default=16, help='混音聲道數')
+    parser.add_argument('--triggers', type=int, default=40, help='觸發次數')
+    parser.add_argument('--interval', type=float, default=0.2, help='觸發間隔 (秒)')
+    parser.add_argument('--output', help='輸出 JSON 報告路徑')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.buffer, args.num_channels, args.triggers, args.interval)
+
+    print("音效延遲測試結果")
+    for key, value in report.items():
+        print(f"  {key}: {value:.2f}" if isinstance(value, float) else f"  {key}: {value}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+# audio_dispatcher.py - 觸碰音效派送模組
+import json
+import os
+import queue
+import threading
+import time
+
+from roi_map import ROILabelMap
+
+
+class AudioDispatcher:
+    """音效派送執行緒：接收檢測迴圈的觸碰事件並直接播放
+
+    AudioManager 只在此執行緒中建立與操作，檢測迴圈只需將事件放入佇列，
+    不經過瀏覽器與 HTTP。冷卻與去重複 (多指同時按下同一 ROI) 都在這裡處理。
+    """
+
+    def __init__(self, dedup_window=0.08, reload_interval=1.0, **audio_options):
+        self.dedup_window = dedup_window        # 同一 ROI 在此時間內的重複觸發只播放一次 (ROI 的 cooldown 可再加長)
+        self.reload_interval = reload_interval  # 檢查 config.json 變動的間隔 (秒)
+        self.audio_options = audio_options
+
+        self.audio_manager = None
+        self.available = False
+        self.commands = queue.SimpleQueue()
+
+        self.project_id = None
+        self.project_path = None
+        self.signature = None
+        self.last_checked = 0
+        self.rois = {}
+        self.last_triggered = {}
+        self.provisional = {}  # 指尖 ID -> 預測觸碰已播放的 ROI
+
+        self.dispatch_latencies = []  # 事件時間到送入混音器 (秒)
+        self._ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='audio-dispatch', daemon=True)
+        self.thread.start()
+        self._ready.wait(5)
+
+    # 以下方法可由任何執行緒呼叫，只將指令放入佇列
+
+    def submit(self, touch_events):
+        """由檢測迴圈送入本幀的觸碰事件"""
+        if touch_events:
+            self.commands.put(('events', touch_events))
+
+    def set_project(self, project_id, project_path):
+        self.commands.put(('project', project_id, project_path))
+
+    def play_roi(self, roi_id):
+        self.commands.put(('play', roi_id))
+
+    def set_volume(self, volume):
+        self.commands.put(('volume', volume))
+
+    def stop_all(self):
+        self.commands.put(('stop',))
+
+    def get_status(self):
+        """取得派送狀態與延遲統計
+
+        dispatch_*_ms 為檢測到觸碰 (事件時間) 到送入混音器的端對端延遲，
+        實際出聲另加 device_buffer_ms。
+        """
+        latencies = list(self.dispatch_latencies)
+        status = {
+            "available": self.available,
+            "project": self.project_id,
+            "pending": self.commands.qsize(),
+            "dispatch_avg_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            "dispatch_max_ms": max(latencies) * 1000 if latencies else 0.0
+        }
+        if self.audio_manager:
+            status.update(self.audio_manager.get_latency_stats())
+            status["preload"] = self.audio_manager.get_preload_progress()
+        return status
+
+    # 以下方法只在派送執行緒中執行
+
+    def _run(self):
+        try:
+            from audio_manager import AudioManager
+            self.audio_manager = AudioManager(**self.audio_options)
+            self.available = True
+        except Exception as e:
+            print(f"Audio output unavailable: {e}")
+        finally:
+            self._ready.set()
+
+        while True:
+            command = self.commands.get()
+            if not self.available:
+                continue
+            try:
+                self._handle(command)
+            except Exception as e:
+                print(f"Error dispatching audio: {e}")
+
+    def _handle(self, command):
+        name = command[0]
+        if name == 'events':
+            self._refresh()
+            for event in command[1]:
+                self._handle_event(event)
+        elif name == 'play':
+            self._refresh()
+            self._play(self.rois.get(command[1]))
+        elif name == 'project':
+            self.project_id, self.project_path = command[1], command[2]
+            self.signature = None
+            self.last_checked = 0
+            self.last_triggered = {}
+            self.provisional = {}
+            self.rois = {}
+            if self.project_path is None:
+                # 關閉伺服器播放：停止播放中的聲音並釋放前一個專案的釘選音效
+                self.audio_manager.unload_project()
+            self._refresh()
+        elif name == 'volume':
+            self.audio_manager.set_volume(command[1])
+        elif name == 'stop':
+            self.audio_manager.stop_all()
+
+    def _handle_event(self, event):
+        # 只有預測的 touch_down 確實在同一個 ROI 播放過，touch_confirm 才不重複觸發；
+        # 其他情況 (預測未播放、落在其他 ROI) 的 touch_confirm 視同 touch_down 播放
+        if event['type'] in ('touch_confirm', 'touch_cancel'):
+            roi_id = self.provisional.pop(event['finger_id'], None)
+            if event['type'] == 'touch_confirm' and event.get('roi') and event['roi']['id'] == roi_id:
+                return
+            # 取消或落在其他 ROI：停止預測播放的聲音
+            if roi_id is not None:
+                self.audio_manager.stop_roi(roi_id)
+                self.last_triggered.pop(roi_id, None)
+            if event['type'] == 'touch_cancel':
+                return
+        elif event['type'] != 'touch_down':
+            return
+        if not event.get('roi'):
+            return
+
+        roi_id = event['roi']['id']
+        roi = self.rois.get(roi_id)
+        now = time.time()
+        cooldown = max(self.dedup_window, roi.get('cooldown', 0) if roi else 0)
+        if now - self.last_triggered.get(roi_id, 0) < cooldown:
+            return
+
+        # 只記錄實際播放的觸發，未播放的預測不會擋下隨後的 touch_confirm
+        if self._play(roi):
+            self.last_triggered[roi_id] = now
+            if event['type'] == 'touch_down' and event.get('provisional'):
+                self.provisional[event['finger_id']] = roi_id
+            self.dispatch_latencies.append(time.time() - event['timestamp'])
+            del self.dispatch_latencies[:-256]
+
+    def _play(self, roi):
+        if not roi:
+            return False
+        audio_file = roi.get('audio_pcm') or roi.get('audio_file')
+        if not audio_file:
+            return False
+        return self.audio_manager.play_audio(
+            os.path.join(self.project_path, audio_file),
+            roi_id=roi['id'],
+            volume=roi.get('volume', 1.0),
+            priority=roi.get('priority', 0),
+            group=roi.get('group'),
+            retrigger=roi.get('retrigger', 'restart')
+        )
+
+    def _refresh(self):
+        """config.json 變動時重新讀取 ROI 並預載音效"""
+        if self.project_path is None:
+            return
+        now = time.time()
+        if now - self.last_checked < self.reload_interval:
+            return
+        self.last_checked = now
+
+        config_path = os.path.join(self.project_path, 'config.json')
+        try:
+            signature = ROILabelMap.config_signature(config_path)
+            if signature == self.signature:
+                return
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading project audio: {e}")
+            return
+
+        self.signature = signature
+        rois = config.get('rois', [])
+        self.rois = {roi['id']: roi for roi in rois}
+        self.audio_manager.preload_project(self.project_id, self.project_path, rois)
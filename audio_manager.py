@@ -1,55 +1,484 @@
 # audio_manager.py - 音效管理模組
 import pygame
+import heapq
+import mmap
 import os
+import struct
 import threading
+import wave
 import time
+from collections import OrderedDict, deque
+
+from audio_transcoder import PCM_FOLDER, AudioTranscoder
+
+class AudioCache:
+    """以 PCM 位元組數為上限的 LRU 音效快取，釘選的音效不會被淘汰"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # path -> (Sound, bytes)
+        self.pinned = set()
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, audio_path):
+        return audio_path in self.entries
+
+    def get(self, audio_path):
+        """取得音效並標記為最近使用"""
+        with self._lock:
+            entry = self.entries.get(audio_path)
+            if entry is None:
+                return None
+            self.entries.move_to_end(audio_path)
+            return entry[0]
+
+    def put(self, audio_path, sound):
+        """加入音效，超過上限時淘汰最久未使用的未釘選音效
+
+        剛加入的音效不會被淘汰 (釘選音效已佔滿上限時暫時超過上限)。
+        """
+        nbytes = self.pcm_bytes(sound)
+        with self._lock:
+            if audio_path in self.entries:
+                self.total_bytes -= self.entries.pop(audio_path)[1]
+            self.entries[audio_path] = (sound, nbytes)
+            self.total_bytes += nbytes
+            self._evict(keep=audio_path)
+
+    @staticmethod
+    def pcm_bytes(sound):
+        """解碼後的 PCM 大小 (依混音器格式計算，不複製資料)"""
+        frequency, size, channels = pygame.mixer.get_init()
+        return int(round(sound.get_length() * frequency)) * channels * (abs(size) // 8)
+
+    def set_pinned(self, audio_paths):
+        """設定釘選的音效 (目前專案)"""
+        with self._lock:
+            self.pinned = set(audio_paths)
+            self._evict()
+
+    def _evict(self, keep=None):
+        for audio_path in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if audio_path in self.pinned or audio_path == keep:
+                continue
+            self.total_bytes -= self.entries.pop(audio_path)[1]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+class Voice:
+    """正在播放的聲音"""
+
+    def __init__(self, index, token, roi_id, priority, group, ends_at):
+        self.index = index
+        self.token = token
+        self.roi_id = roi_id
+        self.priority = priority
+        self.group = group
+        self.ends_at = ends_at
+
+class VoiceAllocator:
+    """聲道配置：優先權、互斥群組與重新觸發策略
+
+    以預期結束時間回收播放完畢的聲道，不需逐一查詢聲道狀態；
+    聲道不足時搶佔優先權最低、最早開始的聲音。
+    retrigger: 'restart' 重新播放、'overlap' 疊加播放、'ignore' 播放中忽略。
+    因群組、重新觸發或搶佔而中斷的聲音會呼叫 on_evict(聲道) 停止實際播放。
+    """
+
+    def __init__(self, num_channels, on_evict=None):
+        self.num_channels = num_channels
+        self.on_evict = on_evict
+        self.reset()
+
+    def reset(self):
+        self.free = deque(range(self.num_channels))
+        self.voices = {}          # 聲道 -> Voice
+        self.by_priority = {}     # 優先權 -> OrderedDict(聲道)，依開始時間排序
+        self.by_roi = {}          # roi_id -> OrderedDict(聲道)
+        self.by_group = {}        # 互斥群組 -> 聲道
+        self.end_heap = []        # (結束時間, token, 聲道)
+        self.next_token = 0
+
+    def release(self, index):
+        """釋放聲道"""
+        voice = self.voices.pop(index, None)
+        if voice is None:
+            return
+        bucket = self.by_priority[voice.priority]
+        del bucket[index]
+        if not bucket:
+            del self.by_priority[voice.priority]
+        if voice.roi_id is not None:
+            roi_voices = self.by_roi[voice.roi_id]
+            del roi_voices[index]
+            if not roi_voices:
+                del self.by_roi[voice.roi_id]
+        if voice.group is not None and self.by_group.get(voice.group) == index:
+            del self.by_group[voice.group]
+        self.free.append(index)
+
+    def evict(self, index):
+        """中斷播放中的聲音並釋放聲道"""
+        if index not in self.voices:
+            return
+        self.release(index)
+        if self.on_evict:
+            self.on_evict(index)
+
+    def _reclaim(self, now):
+        """回收已播放完畢的聲道"""
+        while self.end_heap and self.end_heap[0][0] <= now:
+            _, token, index = heapq.heappop(self.end_heap)
+            voice = self.voices.get(index)
+            if voice is not None and voice.token == token:
+                self.release(index)
+
+    def _steal(self, priority):
+        """搶佔優先權不高於 priority 的最舊聲音"""
+        if not self.by_priority:
+            return None
+        lowest = min(self.by_priority)
+        if lowest > priority:
+            return None
+        index = next(iter(self.by_priority[lowest]))
+        self.evict(index)
+        return self.free.pop()
+
+    def allocate(self, roi_id=None, priority=0, group=None, retrigger='restart', duration=None, now=None):
+        """配置聲道，無法播放時回傳 None"""
+        now = time.perf_counter() if now is None else now
+        self._reclaim(now)
+
+        if roi_id is not None and roi_id in self.by_roi:
+            if retrigger == 'ignore':
+                return None
+            if retrigger == 'restart':
+                for index in list(self.by_roi[roi_id]):
+                    self.evict(index)
+
+        # 同一群組同時只播放一個聲音
+        if group is not None and group in self.by_group:
+            self.evict(self.by_group[group])
+
+        index = self.free.popleft() if self.free else self._steal(priority)
+        if index is None:
+            return None
+
+        self.next_token += 1
+        ends_at = now + duration if duration is not None else float('inf')
+        voice = Voice(index, self.next_token, roi_id, priority, group, ends_at)
+        self.voices[index] = voice
+        self.by_priority.setdefault(priority, OrderedDict())[index] = None
+        if roi_id is not None:
+            self.by_roi.setdefault(roi_id, OrderedDict())[index] = None
+        if group is not None:
+            self.by_group[group] = index
+        if duration is not None:
+            heapq.heappush(self.end_heap, (ends_at, voice.token, index))
+        return index
+
+class AudioStream:
+    """長音效串流播放：背景執行緒分段讀取 PCM 並排入聲道佇列
+
+    記憶體只保留正在播放與預讀的片段，與音效長度無關。
+    聲道被其他聲音搶佔或停止播放時自動結束。
+    """
+
+    def __init__(self, audio_path, channel, is_current, chunk_seconds=0.5):
+        self.audio_path = audio_path
+        self.channel = channel
+        self.is_current = is_current  # 聲道仍屬於此串流時回傳 True
+        self.chunk_seconds = chunk_seconds
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self, volume):
+        self.channel.set_volume(volume)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            with wave.open(self.audio_path, 'rb') as w:
+                chunk_frames = int(w.getframerate() * self.chunk_seconds)
+
+                def next_chunk():
+                    data = w.readframes(chunk_frames)
+                    return pygame.mixer.Sound(buffer=data) if data else None
+
+                chunk = next_chunk()
+                if chunk is None or not self.is_current():
+                    return
+                self.channel.play(chunk)
+                prefetch = next_chunk()
+
+                while prefetch is not None and self.is_current():
+                    # 佇列空出時補入預讀片段，再讀取下一段
+                    if self.channel.get_queue() is None:
+                        if not self.channel.get_busy():
+                            self.channel.play(prefetch)
+                        else:
+                            self.channel.queue(prefetch)
+                        prefetch = next_chunk()
+                    time.sleep(self.chunk_seconds / 4)
+        except (wave.Error, EOFError, pygame.error) as e:
+            print(f"Failed to stream audio {self.audio_path}: {e}")
 
 class AudioManager:
-    def __init__(self):
-        pygame.mixer.init()
-        self.audio_cache = {}
-        self.last_played = {}
-        self.cooldown_time = 1.0  # 防止重複播放的冷卻時間
-        
+    def __init__(self, frequency=44100, size=-16, channels=2, buffer=256, num_channels=16,
+                 max_cache_bytes=256 * 1024 * 1024, stream_threshold=2 * 1024 * 1024):
+        # 小緩衝區降低輸出延遲，固定聲道池支援多音同時播放
+        pygame.mixer.pre_init(frequency, size, channels, buffer)
+        pygame.mixer.init(frequency, size, channels, buffer)
+        pygame.mixer.set_num_channels(num_channels)
+
+        self.buffer_size = buffer
+        self.channels = [pygame.mixer.Channel(i) for i in range(num_channels)]
+        self.voices = VoiceAllocator(num_channels, on_evict=lambda index: self.channels[index].stop())
+        self.channel_volumes = [1.0] * num_channels
+        self.volume = 1.0
+
+        self.audio_cache = AudioCache(max_cache_bytes)
+        self.stream_threshold = stream_threshold  # 超過此大小的檔案以串流播放，不常駐記憶體
+        self.stream_paths = {}  # path -> (串流的 PCM 路徑, 長度 (秒))
+        self.transcoder = AudioTranscoder(max_workers=1)
+
+        # play_audio 呼叫到送入混音器的時間，不含檢測、派送與裝置緩衝
+        # (端對端延遲見 AudioDispatcher 的 dispatch_*_ms)
+        self.call_latencies = deque(maxlen=256)
+
+        # 背景預載進度
+        self.preload_generation = 0
+        self.preload_progress = {"project": None, "total": 0, "loaded": 0, "failed": 0, "done": True}
+
     def load_audio(self, audio_path):
-        """載入音效檔案"""
-        if audio_path not in self.audio_cache:
-            if os.path.exists(audio_path):
-                try:
-                    self.audio_cache[audio_path] = pygame.mixer.Sound(audio_path)
-                except pygame.error as e:
-                    print(f"Failed to load audio {audio_path}: {e}")
-                    return False
-        return True
-    
-    def play_audio(self, audio_path, roi_id=None):
-        """播放音效"""
-        current_time = time.time()
-        
-        # 檢查冷卻時間
-        if roi_id and roi_id in self.last_played:
-            if current_time - self.last_played[roi_id] < self.cooldown_time:
+        """載入音效檔案 (大型檔案只記錄為串流播放)"""
+        if audio_path not in self.audio_cache and audio_path not in self.stream_paths:
+            if not os.path.exists(audio_path):
                 return False
-        
-        if self.load_audio(audio_path):
+            if os.path.getsize(audio_path) > self.stream_threshold:
+                return self.prepare_stream(audio_path)
             try:
-                self.audio_cache[audio_path].play()
-                if roi_id:
-                    self.last_played[roi_id] = current_time
-                return True
+                sound = self.load_pcm(audio_path) if self.is_mixer_pcm(audio_path) else None
+                self.audio_cache.put(audio_path, sound or pygame.mixer.Sound(audio_path))
             except pygame.error as e:
-                print(f"Failed to play audio {audio_path}: {e}")
-        
-        return False
-    
+                print(f"Failed to load audio {audio_path}: {e}")
+                return False
+        return True
+
+    def prepare_stream(self, audio_path):
+        """記錄串流播放的 PCM 檔案
+
+        壓縮格式或格式不同的 WAV 無法直接分段送入聲道，先轉為標準 PCM (與上傳時背景轉檔的結果相同，
+        已轉檔時直接沿用)，所有串流都經過聲道配置、群組與音量控制。
+        """
+        stream_path = audio_path
+        if not self.is_mixer_pcm(audio_path):
+            folder, filename = os.path.split(audio_path)
+            try:
+                stream_path = os.path.join(folder, self.transcoder.transcode(folder, filename))
+            except Exception as e:
+                print(f"Failed to transcode audio {audio_path}: {e}")
+                return False
+
+        duration = self.pcm_duration(stream_path)
+        if duration is None:
+            print(f"Audio format does not match the mixer: {stream_path}")
+            return False
+        self.stream_paths[audio_path] = (stream_path, duration)
+        return True
+
+    def is_mixer_pcm(self, audio_path):
+        """是否為與混音器格式相同的 PCM WAV (轉檔後的標準格式)"""
+        if os.path.basename(os.path.dirname(audio_path)) != PCM_FOLDER or not audio_path.endswith('.wav'):
+            return False
+        frequency, size, channels = pygame.mixer.get_init()
+        try:
+            with wave.open(audio_path, 'rb') as w:
+                return (w.getframerate() == frequency and w.getnchannels() == channels
+                        and w.getsampwidth() == abs(size) // 8)
+        except (wave.Error, EOFError):
+            return False
+
+    def pcm_duration(self, audio_path):
+        """可分段串流的 PCM 長度 (秒)，格式與混音器不同時回傳 None"""
+        if not self.is_mixer_pcm(audio_path):
+            return None
+        with wave.open(audio_path, 'rb') as w:
+            return w.getnframes() / w.getframerate()
+
+    def load_pcm(self, audio_path):
+        """以 mmap 找出 WAV 的 data chunk 直接交給混音器，不經過解碼
+
+        Sound(buffer=...) 會複製一份 PCM 資料，快取中的音效不引用檔案；
+        mmap 只省去先讀入 Python bytes 的中間複本。
+        """
+        with open(audio_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                chunk = self.find_data_chunk(mapped)
+                if chunk is None:
+                    return None
+                _, sample_size, channels = pygame.mixer.get_init()
+                offset, size = chunk
+                size -= size % (channels * abs(sample_size) // 8)
+                if size == 0:
+                    return None
+                view = memoryview(mapped)[offset:offset + size]
+                try:
+                    return pygame.mixer.Sound(buffer=view)
+                finally:
+                    view.release()
+
+    @staticmethod
+    def find_data_chunk(data):
+        """依序走訪 RIFF chunk，回傳 data chunk 的 (位移, 長度)，找不到時回傳 None
+
+        data 之後可能還有 LIST 等 chunk，不能假設 PCM 資料位於檔尾。
+        """
+        if len(data) < 12 or data[0:4] != b'RIFF' or data[8:12] != b'WAVE':
+            return None
+        offset = 12
+        while offset + 8 <= len(data):
+            chunk_id = data[offset:offset + 4]
+            size, = struct.unpack_from('<I', data, offset + 4)
+            offset += 8
+            if chunk_id == b'data':
+                # 寫入中斷的檔案長度欄位可能超過實際大小
+                return offset, min(size, len(data) - offset)
+            offset += size + (size & 1)  # chunk 以偶數位元組對齊
+        return None
+
+    def preload(self, audio_paths):
+        """預先載入音效，觸發時不需讀取檔案"""
+        return {path: self.load_audio(path) for path in audio_paths}
+
+    @staticmethod
+    def project_audio_paths(project_path, rois):
+        """專案 ROI 參照的音效路徑 (相對路徑以專案資料夾為準)"""
+        paths = []
+        for roi in rois:
+            # 已轉檔的標準 PCM 優先
+            audio_file = roi.get('audio_pcm') or roi.get('audio_file')
+            if audio_file:
+                path = audio_file if os.path.isabs(audio_file) else os.path.join(project_path, audio_file)
+                if path not in paths:
+                    paths.append(path)
+        return paths
+
+    def preload_project(self, project_id, project_path, rois):
+        """在背景執行緒解碼專案所有音效，並釘選於快取中"""
+        audio_paths = self.project_audio_paths(project_path, rois)
+        self.audio_cache.set_pinned(audio_paths)
+
+        self.preload_generation += 1
+        generation = self.preload_generation
+        self.preload_progress = {"project": project_id, "total": len(audio_paths),
+                                 "loaded": 0, "failed": 0, "done": not audio_paths}
+
+        def worker():
+            for audio_path in audio_paths:
+                # 已切換到其他專案時停止
+                if generation != self.preload_generation:
+                    return
+                key = "loaded" if self.load_audio(audio_path) else "failed"
+                self.preload_progress[key] += 1
+            self.preload_progress["done"] = True
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def unload_project(self):
+        """停止所有音效並取消目前專案的預載與釘選"""
+        self.preload_generation += 1
+        self.preload_progress = {"project": None, "total": 0, "loaded": 0, "failed": 0, "done": True}
+        self.audio_cache.set_pinned([])
+        self.stop_all()
+
+    def get_preload_progress(self):
+        """取得預載進度"""
+        return dict(self.preload_progress, cache_bytes=self.audio_cache.total_bytes)
+
+    def play_audio(self, audio_path, roi_id=None, volume=1.0, priority=0, group=None, retrigger='restart'):
+        """播放音效 (只使用已載入的音效，不讀取檔案)"""
+        trigger_time = time.perf_counter()
+
+        if audio_path in self.stream_paths:
+            return self.play_stream(audio_path, roi_id, volume, priority, group, retrigger, trigger_time)
+
+        sound = self.audio_cache.get(audio_path)
+        if sound is None:
+            print(f"Audio not preloaded: {audio_path}")
+            return False
+
+        index = self.voices.allocate(roi_id, priority, group, retrigger, sound.get_length(), trigger_time)
+        if index is None:
+            return False
+
+        try:
+            channel = self.channels[index]
+            self.channel_volumes[index] = volume
+            channel.set_volume(volume * self.volume)
+            channel.play(sound)
+        except pygame.error as e:
+            print(f"Failed to play audio {audio_path}: {e}")
+            self.voices.release(index)
+            return False
+
+        self.call_latencies.append(time.perf_counter() - trigger_time)
+        return True
+
+    def play_stream(self, audio_path, roi_id, volume, priority, group, retrigger, trigger_time):
+        """串流播放長音效"""
+        stream_path, duration = self.stream_paths[audio_path]
+        index = self.voices.allocate(roi_id, priority, group, retrigger, duration, trigger_time)
+        if index is None:
+            return False
+        token = self.voices.voices[index].token
+
+        def is_current():
+            voice = self.voices.voices.get(index)
+            return voice is not None and voice.token == token
+
+        self.channel_volumes[index] = volume
+        AudioStream(stream_path, self.channels[index], is_current).start(volume * self.volume)
+
+        self.call_latencies.append(time.perf_counter() - trigger_time)
+        return True
+
+    def stop_roi(self, roi_id):
+        """停止 ROI 正在播放的聲音 (例如取消的預測觸碰)"""
+        for index in list(self.voices.by_roi.get(roi_id, ())):
+            self.voices.evict(index)
+
     def stop_all(self):
         """停止所有音效"""
         pygame.mixer.stop()
-    
+        self.voices.reset()
+
     def set_volume(self, volume):
         """設定音量 (0.0-1.0)"""
-        pygame.mixer.music.set_volume(volume)
-    
+        self.volume = max(0.0, min(1.0, volume))
+        for channel, channel_volume in zip(self.channels, self.channel_volumes):
+            channel.set_volume(channel_volume * self.volume)
+
+    def get_latency_stats(self):
+        """取得延遲統計 (毫秒)
+
+        call_*: play_audio 內部處理時間 (聲道配置與送入混音器)；
+        device_buffer_ms: 混音器緩衝區造成的輸出延遲。
+        """
+        frequency, _, _ = pygame.mixer.get_init()
+        latencies = list(self.call_latencies)
+        return {
+            "device_buffer_ms": self.buffer_size / frequency * 1000,
+            "call_count": len(latencies),
+            "call_avg_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            "call_max_ms": max(latencies) * 1000 if latencies else 0.0
+        }
+
     def get_supported_formats(self):
         """取得支援的音效格式"""
-        return ['.wav', '.mp3', '.ogg', '.m4a']
\ No newline at end of file
+        return ['.wav', '.mp3', '.ogg', '.m4a']
@@ -0,0 +1,147 @@
+# audio_transcoder.py - 上傳音效轉檔模組
+import hashlib
+import os
+import shutil
+import subprocess
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# 標準 PCM 格式 (與 AudioManager 混音器設定一致)
+PCM_RATE = 44100
+PCM_CHANNELS = 2
+PCM_SAMPLE_WIDTH = 2
+PCM_FOLDER = 'pcm'
+
+# ffmpeg 解碼逾時 (秒)，損毀或異常的檔案不會佔住轉檔工作池
+DECODE_TIMEOUT = 120
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """計算檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def decode_audio(path, rate=PCM_RATE, channels=PCM_CHANNELS, timeout=DECODE_TIMEOUT):
+    """解碼音效為 float32 陣列 (frames, channels)，數值範圍 -1.0~1.0"""
+    if shutil.which('ffmpeg'):
+        result = subprocess.run(
+            ['ffmpeg', '-v', 'error', '-i', path, '-f', 's16le', '-acodec', 'pcm_s16le',
+             '-ac', str(channels), '-ar', str(rate), '-'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, timeout=timeout)
+        samples = np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, channels)
+        return samples.astype(np.float32) / 32768.0
+
+    # 沒有 ffmpeg 時只支援 16-bit WAV
+    if not path.lower().endswith('.wav'):
+        raise ValueError(f"需要 ffmpeg 才能解碼 {os.path.basename(path)}")
+
+    with wave.open(path, 'rb') as w:
+        if w.getsampwidth() != 2:
+            raise ValueError("只支援 16-bit WAV")
+        src_rate = w.getframerate()
+        src_channels = w.getnchannels()
+        frames = w.readframes(w.getnframes())
+
+    samples = np.frombuffer(frames, dtype=np.int16).reshape(-1, src_channels).astype(np.float32) / 32768.0
+
+    # 聲道轉換
+    if src_channels != channels:
+        mono = samples.mean(axis=1, keepdims=True)
+        samples = np.repeat(mono, channels, axis=1)
+
+    # 線性內插重新取樣
+    if src_rate != rate and len(samples) > 1:
+        duration = len(samples) / src_rate
+        src_t = np.arange(len(samples)) / src_rate
+        dst_t = np.arange(int(duration * rate)) / rate
+        samples = np.stack([np.interp(dst_t, src_t, samples[:, c]) for c in range(channels)], axis=1)
+
+    return samples.astype(np.float32)
+
+
+def trim_silence(samples, threshold_db=-50):
+    """去除頭尾靜音"""
+    if len(samples) == 0:
+        return samples
+    threshold = 10 ** (threshold_db / 20)
+    loud = np.flatnonzero(np.abs(samples).max(axis=1) > threshold)
+    if len(loud) == 0:
+        return samples[:0]
+    return samples[loud[0]:loud[-1] + 1]
+
+
+def normalize_loudness(samples, target_dbfs=-16, peak_limit=0.98):
+    """以 RMS 響度正規化，並限制峰值避免破音"""
+    if len(samples) == 0:
+        return samples
+    rms = float(np.sqrt(np.mean(samples ** 2)))
+    if rms == 0:
+        return samples
+    gain = 10 ** (target_dbfs / 20) / rms
+    peak = float(np.abs(samples).max()) * gain
+    if peak > peak_limit:
+        gain *= peak_limit / peak
+    return samples * gain
+
+
+def write_pcm_wav(path, samples, rate=PCM_RATE):
+    """原子寫入 16-bit PCM WAV"""
+    pcm = np.clip(samples * 32767.0, -32768, 32767).astype('<i2')
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with wave.open(tmp_path, 'wb') as w:
+        w.setnchannels(samples.shape[1])
+        w.setsampwidth(PCM_SAMPLE_WIDTH)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    os.replace(tmp_path, path)
+
+
+class AudioTranscoder:
+    """上傳音效轉為標準 PCM (固定取樣率/聲道、響度正規化、去除靜音)
+
+    轉檔結果以內容雜湊命名，存放於專案的 pcm 資料夾，
+    相同內容只轉檔一次。
+    """
+
+    def __init__(self, max_workers=2, target_dbfs=-16, silence_db=-50):
+        self.target_dbfs = target_dbfs
+        self.silence_db = silence_db
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transcode')
+
+    def transcode(self, project_path, filename):
+        """轉檔並回傳相對於專案資料夾的 PCM 檔名"""
+        source_path = os.path.join(project_path, filename)
+        digest = file_hash(source_path)
+
+        pcm_folder = os.path.join(project_path, PCM_FOLDER)
+        os.makedirs(pcm_folder, exist_ok=True)
+        pcm_name = f"{PCM_FOLDER}/{digest}.wav"
+        pcm_path = os.path.join(project_path, pcm_name)
+
+        if not os.path.exists(pcm_path):
+            samples = decode_audio(source_path)
+            samples = trim_silence(samples, self.silence_db)
+            samples = normalize_loudness(samples, self.target_dbfs)
+            write_pcm_wav(pcm_path, samples)
+
+        return pcm_name
+
+    def submit(self, project_path, filename, callback=None):
+        """交由背景工作池轉檔，完成後呼叫 callback(pcm_name)"""
+        def job():
+            try:
+                pcm_name = self.transcode(project_path, filename)
+            except Exception as e:
+                print(f"Error transcoding {filename}: {e}")
+                return None
+            if callback:
+                callback(pcm_name)
+            return pcm_name
+
+        return self.executor.submit(job)
@@ -22,6 +22,9 @@ import time
 
 from pyorbbecsdk import *
 from utils import frame_to_bgr_image
+from roi_map import ROITouchResolver
+from touch_tracker import TouchTracker
+from event_stream import DetectionBroadcaster
 
 class A4DepthStreamDetector:
     def __init__(self):
@@ -61,6 +64,36 @@ class A4DepthStreamDetector:
         self.calibration_frames = 0
         self.max_calibration_frames = 30
         
+        # 觸碰狀態機：進入/離開閾值分開 (遲滯)，連續幀數防彈跳
+        self.TOUCH_EXIT_THRESHOLD = 45  # 45mm 離開閾值
+        self.touch_tracker = TouchTracker(
+            enter_threshold=self.TOUCH_DEPTH_THRESHOLD,
+            exit_threshold=self.TOUCH_EXIT_THRESHOLD,
+            min_down_frames=2,
+            min_up_frames=2
+        )
+        
+        # 目前播放專案的 ROI 觸碰解析
+        self.roi_resolver = ROITouchResolver()
+        
+        # 檢測結果推播
+        self.broadcaster = DetectionBroadcaster()
+        
+        # 觸碰事件接收者 (例如音效派送)，在檢測迴圈中每幀呼叫
+        self.touch_listeners = []
+        
+    def set_active_project(self, project_id, project_path):
+        """設定要解析 ROI 觸碰的專案"""
+        self.roi_resolver.set_project(project_id, project_path)
+        
+    def add_touch_listener(self, listener):
+        """註冊觸碰事件接收者，listener(touch_events) 需立即返回"""
+        self.touch_listeners.append(listener)
+        
+    def get_touch_events(self, since=0):
+        """取得序號之後的觸碰事件"""
+        return self.touch_tracker.events_since(since)
+        
     def __del__(self):
         """清理資源"""
         try:
@@ -456,6 +489,26 @@ class A4DepthStreamDetector:
                         print(f"手指: {finger_depth:.0f}mm | 平面: {self.paper_depth_reference:.0f}mm | "
                               f"距離: {abs(depth_diff):.0f}mm | {contact_state.upper()}")
             
+            # 觸碰狀態機 (無有效深度時維持上一幀狀態)
+            now = time.time()
+            self.roi_resolver.refresh(now)
+            tracker_input = [{
+                "position": f["position"],
+                "a4_coord": f["a4_coord"],
+                "depth_diff": f["depth_diff"] if f["contact_state"] in ("touch", "hover", "far") else None
+            } for f in touching_fingers]
+            touch_events = self.touch_tracker.update(tracker_input, now, self.roi_resolver.lookup)
+            if touch_events:
+                for listener in self.touch_listeners:
+                    listener(touch_events)
+            for finger_data, tracked in zip(touching_fingers, tracker_input):
+                finger_data["finger_id"] = tracked["finger_id"]
+                finger_data["touching"] = tracked["touching"]
+            
+            # ROI 觸碰解析
+            touch_coords = [f["a4_coord"] for f in touching_fingers if f["touching"]]
+            roi_touches = self.roi_resolver.resolve(touch_coords, now)
+            
             # 顯示狀態
             self.draw_status_info(display_frame, board_detected, detected_markers, 
                                  touching_fingers, self.paper_depth_reference)
@@ -465,10 +518,17 @@ class A4DepthStreamDetector:
                 "board": board_detected,
                 "hands": touching_fingers if touching_fingers else [{"position": pos, "a4_coord": None} for pos in hand_positions],
                 "detected_markers": detected_markers,
+                "roi_touches": roi_touches,
+                "touch_events": touch_events,
+                "touch_seq": self.touch_tracker.last_seq,
                 "depth_reference": float(self.paper_depth_reference) if self.paper_depth_reference is not None else None,
                 "calibration_progress": self.calibration_frames / self.max_calibration_frames
             }
             
+            # 推播給訂閱頁面 (每幀只序列化一次)
+            if self.broadcaster.has_subscribers():
+                self.broadcaster.publish(self.get_detection_results(), touch_events)
+            
             # 編碼輸出
             ret, buffer = cv2.imencode('.jpg', display_frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
             if ret:
@@ -482,12 +542,21 @@ class A4DepthStreamDetector:
         return Response(self.generate_frames(),
                        mimetype='multipart/x-mixed-replace; boundary=frame')
     
+    def get_event_stream(self, touch_only=False):
+        """獲取檢測結果推播流 (SSE)"""
+        subscription = self.broadcaster.subscribe(touch_only)
+        return Response(self.broadcaster.stream(subscription),
+                       mimetype='text/event-stream',
+                       headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
     def get_detection_results(self):
         """獲取檢測結果"""
         results = {
             "board": bool(self.detection_results.get("board", False)),
             "hands": [],
             "detected_markers": [int(x) for x in self.detection_results.get("detected_markers", [])],
+            "roi_touches": list(self.detection_results.get("roi_touches", [])),
+            "touch_seq": int(self.detection_results.get("touch_seq", 0)),
             "depth_reference": self.detection_results.get("depth_reference"),
             "calibration_progress": float(self.detection_results.get("calibration_progress", 0))
         }
@@ -501,7 +570,8 @@ class A4DepthStreamDetector:
                     "finger_depth": float(hand.get("finger_depth", 0)),
                     "depth_diff": float(hand.get("depth_diff", 0)),
                     "contact_state": hand.get("contact_state", "unknown"),
-                    "is_touching": hand.get("contact_state") == "touch"
+                    "finger_id": hand.get("finger_id"),
+                    "is_touching": bool(hand.get("touching", hand.get("contact_state") == "touch"))
                 }
             else:
                 hand_data = {
@@ -510,6 +580,7 @@ class A4DepthStreamDetector:
                     "finger_depth": 0,
                     "depth_diff": 0,
                     "contact_state": "unknown",
+                    "finger_id": None,
                     "is_touching": False
                 }
             results["hands"].append(hand_data)
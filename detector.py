@@ -2,8 +2,13 @@
 import cv2
 import numpy as np
 import mediapipe as mp
+import time
 from flask import Response
 
+from roi_map import ROITouchResolver
+from touch_tracker import TouchTracker
+from event_stream import DetectionBroadcaster
+
 class A4WebStreamDetector:
     def __init__(self):
         self.mp_hands = mp.solutions.hands
@@ -26,6 +31,30 @@ class A4WebStreamDetector:
         self.a4_width = 210
         self.a4_height = 297
         
+        # 觸碰狀態機：陰影判斷需連續幀數才切換 (防彈跳)
+        self.touch_tracker = TouchTracker(min_down_frames=2, min_up_frames=3)
+        
+        # 目前播放專案的 ROI 觸碰解析
+        self.roi_resolver = ROITouchResolver()
+        
+        # 檢測結果推播
+        self.broadcaster = DetectionBroadcaster()
+        
+        # 觸碰事件接收者 (例如音效派送)，在檢測迴圈中每幀呼叫
+        self.touch_listeners = []
+        
+    def set_active_project(self, project_id, project_path):
+        """設定要解析 ROI 觸碰的專案"""
+        self.roi_resolver.set_project(project_id, project_path)
+        
+    def add_touch_listener(self, listener):
+        """註冊觸碰事件接收者，listener(touch_events) 需立即返回"""
+        self.touch_listeners.append(listener)
+        
+    def get_touch_events(self, since=0):
+        """取得序號之後的觸碰事件"""
+        return self.touch_tracker.events_since(since)
+        
     def detect_aruco_markers(self, image):
         """檢測 ArUco 標記"""
         corners, ids, _ = cv2.aruco.detectMarkers(image, self.aruco_dict, parameters=self.aruco_params)
@@ -203,14 +232,25 @@ class A4WebStreamDetector:
             hand_positions, display_frame = self.detect_hands(display_frame)
             
             # 接觸檢測
-            touching_fingers = []
+            tracker_input = []
             if board_detected and hand_positions and paper_mask is not None:
                 for finger_pos in hand_positions:
                     is_touching = self.detect_finger_shadow(display_frame, finger_pos, paper_mask)
-                    if is_touching:
-                        a4_coord = self.pixel_to_a4_coordinate(finger_pos, marker_positions)
-                        if a4_coord:
-                            touching_fingers.append({"position": finger_pos, "a4_coord": a4_coord})
+                    a4_coord = self.pixel_to_a4_coordinate(finger_pos, marker_positions)
+                    tracker_input.append({"position": finger_pos, "a4_coord": a4_coord, "is_touching": is_touching})
+            
+            # 觸碰狀態機
+            now = time.time()
+            self.roi_resolver.refresh(now)
+            touch_events = self.touch_tracker.update(tracker_input, now, self.roi_resolver.lookup)
+            if touch_events:
+                for listener in self.touch_listeners:
+                    listener(touch_events)
+            touching_fingers = [{"position": f["position"], "a4_coord": f["a4_coord"], "finger_id": f["finger_id"]}
+                                for f in tracker_input if f["touching"] and f["a4_coord"]]
+            
+            # ROI 觸碰解析
+            roi_touches = self.roi_resolver.resolve([f["a4_coord"] for f in touching_fingers], now)
             
             # 顯示狀態
             status_text = f"A4 棋盤: {'✓' if board_detected else '✗'} ({len(detected_markers)}/4 標記)"
@@ -238,9 +278,16 @@ class A4WebStreamDetector:
             self.detection_results = {
                 "board": board_detected,
                 "hands": touching_fingers if touching_fingers else hand_positions,
-                "detected_markers": detected_markers
+                "detected_markers": detected_markers,
+                "roi_touches": roi_touches,
+                "touch_events": touch_events,
+                "touch_seq": self.touch_tracker.last_seq
             }
             
+            # 推播給訂閱頁面 (每幀只序列化一次)
+            if self.broadcaster.has_subscribers():
+                self.broadcaster.publish(self.get_detection_results(), touch_events)
+            
             # 編碼輸出
             ret, buffer = cv2.imencode('.jpg', display_frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
             frame_bytes = buffer.tobytes()
@@ -253,13 +300,22 @@ class A4WebStreamDetector:
         return Response(self.generate_frames(),
                        mimetype='multipart/x-mixed-replace; boundary=frame')
     
+    def get_event_stream(self, touch_only=False):
+        """獲取檢測結果推播流 (SSE)"""
+        subscription = self.broadcaster.subscribe(touch_only)
+        return Response(self.broadcaster.stream(subscription),
+                       mimetype='text/event-stream',
+                       headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
     def get_detection_results(self):
         """獲取檢測結果（確保JSON可序列化）"""
         # 轉換numpy類型為Python原生類型
         results = {
             "board": bool(self.detection_results.get("board", False)),
             "hands": [],
-            "detected_markers": [int(x) for x in self.detection_results.get("detected_markers", [])]
+            "detected_markers": [int(x) for x in self.detection_results.get("detected_markers", [])],
+            "roi_touches": list(self.detection_results.get("roi_touches", [])),
+            "touch_seq": int(self.detection_results.get("touch_seq", 0))
         }
         
         # 處理hands資料
@@ -267,7 +323,8 @@ class A4WebStreamDetector:
             if isinstance(hand, dict):
                 hand_data = {
                     "position": [int(hand["position"][0]), int(hand["position"][1])] if "position" in hand else None,
-                    "a4_coord": [float(hand["a4_coord"][0]), float(hand["a4_coord"][1])] if "a4_coord" in hand else None
+                    "a4_coord": [float(hand["a4_coord"][0]), float(hand["a4_coord"][1])] if "a4_coord" in hand else None,
+                    "finger_id": hand.get("finger_id")
                 }
             else:
                 # 如果是位置tuple
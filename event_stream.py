@@ -0,0 +1,90 @@
+# event_stream.py - 檢測結果推播模組 (Server-Sent Events)
+import json
+import threading
+from collections import deque
+
+
+class StreamSubscription:
+    """單一訂閱者的待送資料
+
+    檢測結果只保留最新一筆 (慢速用戶端自動丟棄過期狀態)，
+    觸碰事件保留有限數量，超過時丟棄最舊的事件。
+    """
+
+    def __init__(self, touch_only=False, max_pending_events=64):
+        self.touch_only = touch_only
+        self.latest = None
+        self.events = deque(maxlen=max_pending_events)
+        self.dropped_events = 0
+        self.closed = False
+
+
+class DetectionBroadcaster:
+    """將每幀檢測結果推播給所有訂閱頁面"""
+
+    def __init__(self, max_pending_events=64, keepalive_interval=15.0):
+        self.max_pending_events = max_pending_events
+        self.keepalive_interval = keepalive_interval
+        self.subscriptions = set()
+        self._cond = threading.Condition()
+
+    def has_subscribers(self):
+        return bool(self.subscriptions)
+
+    def subscribe(self, touch_only=False):
+        """新增訂閱"""
+        subscription = StreamSubscription(touch_only, self.max_pending_events)
+        with self._cond:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """取消訂閱"""
+        with self._cond:
+            subscription.closed = True
+            self.subscriptions.discard(subscription)
+            self._cond.notify_all()
+
+    def publish(self, results, touch_events=()):
+        """發佈一幀結果，序列化一次後由所有訂閱者共用"""
+        if not self.subscriptions:
+            return
+
+        results_payload = json.dumps(results, ensure_ascii=False)
+        event_payloads = [json.dumps(event, ensure_ascii=False) for event in touch_events]
+
+        with self._cond:
+            for subscription in self.subscriptions:
+                if not subscription.touch_only:
+                    subscription.latest = results_payload
+                for payload in event_payloads:
+                    if len(subscription.events) == subscription.events.maxlen:
+                        subscription.dropped_events += 1
+                    subscription.events.append(payload)
+            self._cond.notify_all()
+
+    def _next_batch(self, subscription):
+        """等待並取出待送資料，逾時回傳空列表 (送出 keepalive)"""
+        with self._cond:
+            if subscription.latest is None and not subscription.events and not subscription.closed:
+                self._cond.wait(self.keepalive_interval)
+
+            batch = [('touch', payload) for payload in subscription.events]
+            subscription.events.clear()
+            if subscription.latest is not None:
+                batch.append(('detection', subscription.latest))
+                subscription.latest = None
+            return batch
+
+    def stream(self, subscription):
+        """產生 SSE 格式的資料流"""
+        try:
+            yield "retry: 1000\n\n"
+            while not subscription.closed:
+                batch = self._next_batch(subscription)
+                if not batch:
+                    yield ": keepalive\n\n"
+                    continue
+                yield ''.join(f"event: {name}\ndata: {payload}\n\n" for name, payload in batch)
+        finally:
+            self.unsubscribe(subscription)
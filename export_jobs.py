@@ -0,0 +1,130 @@
+# export_jobs.py - 專案匯出工作佇列模組
+import glob
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+EXPORT_FOLDER = 'exports'
+EXPORT_VERSION = re.compile(r'^v(\d+)_')
+
+
+class ExportQueue:
+    """專案圖片匯出交由背景工作池處理，請求立即取得工作 ID
+
+    匯出結果以專案版本與尺寸命名 (exports/v<版本>_<寬>x<高>.png)，
+    同一版本再次匯出時直接回傳已完成的檔案；相同內容的工作進行中時共用同一工作。
+    新版本完成後刪除同尺寸的舊版本檔案，指向舊檔案的工作標記為 expired。
+    """
+
+    def __init__(self, file_manager, max_workers=2, max_jobs=200):
+        self.file_manager = file_manager
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export')
+        self.jobs = OrderedDict()   # job_id -> 工作狀態
+        self._active = {}           # (專案, 版本, 寬, 高) -> 進行中的 job_id
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def export_name(version, width, height):
+        return f"{EXPORT_FOLDER}/v{version}_{width}x{height}.png"
+
+    def _add_job(self, project_id, project, filename, status):
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'project_id': project_id,
+            'version': project.get('version', 0),
+            'status': status,       # queued / running / done / error / expired
+            'progress': 1.0 if status == 'done' else 0.0,
+            'filename': filename,
+            'download_name': f"{project['name']}_export.png",
+            'error': None
+        }
+        self.jobs[job['id']] = job
+        while len(self.jobs) > self.max_jobs:
+            self.jobs.popitem(last=False)
+        return job
+
+    def submit(self, project_id, width=800, height=600):
+        """建立匯出工作，回傳工作狀態 (已有快取時狀態直接為 done)；專案不存在時回傳 None"""
+        project = self.file_manager.load_project(project_id)
+        if project is None:
+            return None
+
+        filename = self.export_name(project.get('version', 0), width, height)
+        key = (project_id, project.get('version', 0), width, height)
+        with self._lock:
+            active = self._active.get(key)
+            if active in self.jobs:
+                return dict(self.jobs[active])
+
+            if os.path.exists(os.path.join(self.file_manager.projects_folder, project_id, filename)):
+                return dict(self._add_job(project_id, project, filename, 'done'))
+
+            job = self._add_job(project_id, project, filename, 'queued')
+            self._active[key] = job['id']
+
+        self.executor.submit(self._run, job['id'], key, project, width, height)
+        return dict(job)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job:
+                job.update(fields)
+
+    def _run(self, job_id, key, project, width, height):
+        import cv2
+
+        project_id = key[0]
+        self._update(job_id, status='running')
+        try:
+            canvas = self.file_manager.render_project_image(
+                project, project_id, width, height,
+                progress=lambda value: self._update(job_id, progress=round(value, 3)))
+
+            export_folder = os.path.join(self.file_manager.projects_folder, project_id, EXPORT_FOLDER)
+            os.makedirs(export_folder, exist_ok=True)
+            ok, encoded = cv2.imencode('.png', canvas)
+            if not ok:
+                raise ValueError('PNG 編碼失敗')
+
+            # 原子寫入
+            export_path = os.path.join(self.file_manager.projects_folder, project_id, self.export_name(*key[1:]))
+            tmp_path = f"{export_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(encoded.tobytes())
+            os.replace(tmp_path, export_path)
+            self._update(job_id, status='done', progress=1.0)
+            self._remove_older(project_id, key[1], width, height)
+        except Exception as e:
+            print(f"Error exporting project {project_id}: {e}")
+            self._update(job_id, status='error', error=str(e))
+        finally:
+            with self._lock:
+                self._active.pop(key, None)
+
+    def _remove_older(self, project_id, version, width, height):
+        """刪除同尺寸較舊版本的檔案 (較晚完成的舊版本工作不會刪除新版本)"""
+        export_folder = os.path.join(self.file_manager.projects_folder, project_id, EXPORT_FOLDER)
+        removed = set()
+        for old_path in glob.glob(os.path.join(export_folder, f"v*_{width}x{height}.png")):
+            match = EXPORT_VERSION.match(os.path.basename(old_path))
+            if match and int(match.group(1)) < version:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+                removed.add(f"{EXPORT_FOLDER}/{os.path.basename(old_path)}")
+
+        with self._lock:
+            for job in self.jobs.values():
+                if job['project_id'] == project_id and job['status'] == 'done' and job['filename'] in removed:
+                    job.update(status='expired', error='已有較新版本的匯出')
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
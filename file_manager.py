@@ -1,41 +1,84 @@
 # file_manager.py - 檔案管理模組
-import json
+import math
 import os
+import re
+import threading
 import uuid
 from datetime import datetime
 from werkzeug.utils import secure_filename
 
+from asset_store import AssetStore
+from audio_transcoder import file_hash
+from image_variants import pick_variant
+from project_repository import open_repository
+from search_index import SearchIndex
+from upload_stream import HashingUpload, sniff
+
+# 以內容雜湊命名的檔案 (例如 pcm/<sha256>.wav) 內容不會改變
+HASHED_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+# 不列入素材清單的專案檔案
+INTERNAL_FILES = ('config.json', 'roi_labels.npy', 'roi_labels.json')
+
+# ROI 播放中再次觸發時的處理方式 (由 audio_manager.VoiceAllocator 與 play.js 執行)
+RETRIGGER_POLICIES = ('restart', 'overlap', 'ignore')
+
+# 各 ROI 類型的幾何欄位 (編輯器畫布座標)
+ROI_GEOMETRY = {
+    'rectangle': ('x', 'y', 'width', 'height'),
+    'circle': ('x', 'y', 'radius'),
+    'polygon': ('points',)
+}
+
+
+def roi_number(value, key):
+    """ROI 的數值欄位 (幾何、音量、冷卻時間) 必須是有限的數字"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{key} 必須是數字")
+    return value
+
 class FileManager:
     def __init__(self, projects_folder):
         self.projects_folder = projects_folder
         os.makedirs(projects_folder, exist_ok=True)
+        
+        # 專案設定存取 (JSON 檔案快取或 SQLite)
+        self.repository = open_repository(projects_folder)
+        
+        # 上傳素材以內容雜湊儲存，跨專案共用
+        self.assets = AssetStore(projects_folder)
+        
+        # 搜尋索引隨每次儲存增量更新，首次搜尋時才建立完整索引
+        self.search_index = SearchIndex()
+        self.repository.add_change_listener(self.search_index.index_project)
+        self._search_ready = False
+        self._search_lock = threading.Lock()
+        
+        # 檔案雜湊快取：路徑 -> (mtime_ns, 大小, sha256)
+        self._digests = {}
+        self._digest_lock = threading.Lock()
     
     def list_projects(self):
         """列出所有專案"""
         projects = []
-        if not os.path.exists(self.projects_folder):
-            return projects
-            
-        for folder_name in os.listdir(self.projects_folder):
-            project_path = os.path.join(self.projects_folder, folder_name)
-            config_path = os.path.join(project_path, 'config.json')
-            
-            if os.path.isdir(project_path) and os.path.exists(config_path):
-                try:
-                    with open(config_path, 'r', encoding='utf-8') as f:
-                        config = json.load(f)
-                        config['folder_name'] = folder_name
-                        projects.append(config)
-                except Exception as e:
-                    print(f"Error loading project {folder_name}: {e}")
+        for folder_name, config in self.repository.list():
+            config['folder_name'] = folder_name
+            projects.append(config)
         
         return sorted(projects, key=lambda x: x.get('created_at', ''), reverse=True)
     
-    def create_project(self, name, background_image=None):
+    def search(self, query, limit=20):
+        """搜尋專案名稱、ROI 名稱、音效檔名與日期"""
+        with self._search_lock:
+            if not self._search_ready:
+                for folder_name, config in self.repository.list():
+                    self.search_index.index_project(folder_name, config)
+                self._search_ready = True
+        return self.search_index.search(query, limit)
+    
+    def create_project(self, name, background_image=None, project_id=None):
         """創建新專案"""
-        folder_name = secure_filename(name) + '_' + str(uuid.uuid4())[:8]
-        project_path = os.path.join(self.projects_folder, folder_name)
-        os.makedirs(project_path, exist_ok=True)
+        folder_name = project_id or secure_filename(name) + '_' + str(uuid.uuid4())[:8]
         
         project_config = {
             'name': name,
@@ -44,41 +87,35 @@ class FileManager:
             'rois': []
         }
         
-        config_path = os.path.join(project_path, 'config.json')
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(project_config, f, ensure_ascii=False, indent=2)
+        self.repository.save(folder_name, project_config)
         
         project_config['folder_name'] = folder_name
         return project_config
     
     def load_project(self, project_name):
         """載入專案"""
-        config_path = os.path.join(self.projects_folder, project_name, 'config.json')
-        
-        if not os.path.exists(config_path):        
-            try:
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    config['folder_name'] = project_name
-                    return config
-            except Exception as e:
-                print(f"Error loading project {project_name}: {e}")
-                return None
-    def export_project_image(self, project_name, canvas_width=800, canvas_height=600):
-        """導出專案為圖片（背景+ROI）"""
-        project = self.load_project(project_name)
-        if not project:
-            return None
-        
+        config = self.repository.get(project_name)
+        if config is not None:
+            config['folder_name'] = project_name
+        return config
+    
+    @staticmethod
+    def background_variant(project, width, height):
+        """寬高皆足夠的最小背景版本，尚未產生版本時使用原圖"""
+        return pick_variant(project.get('background_variants'), width, height) or project.get('background_image')
+    
+    def render_project_image(self, project, project_name, canvas_width=800, canvas_height=600, progress=None):
+        """繪製專案圖片（背景+ROI），progress(0~1) 回報進度"""
         import cv2
         import numpy as np
         
         # 創建畫布
         canvas = np.ones((canvas_height, canvas_width, 3), dtype=np.uint8) * 255
         
-        # 載入背景圖片
-        if project.get('background_image'):
-            bg_path = os.path.join(self.projects_folder, project_name, project['background_image'])
+        # 載入背景圖片 (使用足夠畫布尺寸的最小版本)
+        background = self.background_variant(project, canvas_width, canvas_height)
+        if background:
+            bg_path = os.path.join(self.projects_folder, project_name, background)
             if os.path.exists(bg_path):
                 bg_image = cv2.imread(bg_path)
                 if bg_image is not None:
@@ -86,8 +123,12 @@ class FileManager:
                     bg_resized = cv2.resize(bg_image, (canvas_width, canvas_height))
                     canvas = bg_resized
         
+        rois = project.get('rois', [])
+        if progress:
+            progress(0.2)
+        
         # 繪製 ROI
-        for roi in project.get('rois', []):
+        for i, roi in enumerate(rois):
             if roi['type'] == 'rectangle':
                 # 將 A4 座標轉換為畫布座標
                 x = int(roi['x'] * canvas_width / 210)
@@ -116,118 +157,231 @@ class FileManager:
                 cv2.putText(canvas, roi['name'], 
                            (center_x - 20, center_y - radius - 10), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            
+            if progress:
+                progress(0.2 + 0.7 * (i + 1) / len(rois))
         
-        # 儲存導出圖片
-        export_filename = f"{project['name']}_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-        export_path = os.path.join(self.projects_folder, project_name, export_filename)
-        
-        success = cv2.imwrite(export_path, canvas)
-        return export_filename if success else None
+        return canvas
     
     def save_project(self, project_name, config):
         """儲存專案"""
-        config_path = os.path.join(self.projects_folder, project_name, 'config.json')
-        
-        # 移除 folder_name，因為這不應該存在配置文件中
-        save_config = config.copy()
-        save_config.pop('folder_name', None)
-        
         try:
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(save_config, f, ensure_ascii=False, indent=2)
-            return True
+            return self.repository.save(project_name, config)
         except Exception as e:
             print(f"Error saving project {project_name}: {e}")
             return False
     
     def delete_project(self, project_name):
-        """刪除專案"""
-        project_path = os.path.join(self.projects_folder, project_name)
-        
+        """刪除專案，並移除已無其他專案引用的素材"""
         try:
-            import shutil
-            shutil.rmtree(project_path)
+            self.repository.delete(project_name)
+            self.assets.release_project(project_name)
             return True
         except Exception as e:
             print(f"Error deleting project {project_name}: {e}")
             return False
     
-    def add_roi(self, project_name, roi_data):
-        """新增 ROI"""
-        config = self.load_project(project_name)
-        if not config:
-            return None
-        
-        roi_id = str(uuid.uuid4())
+    @staticmethod
+    def validate_roi(roi):
+        """檢查並轉換 ROI 欄位 (就地修改並回傳)，格式錯誤時拋出 ValueError
+
+        儲存的 ROI 會直接用於標籤圖繪製與聲道配置，錯誤的值必須在請求時拒絕。
+        """
+        if roi.get('type') not in ROI_GEOMETRY:
+            raise ValueError(f"type 必須是 {' / '.join(ROI_GEOMETRY)}")
+        for key in ROI_GEOMETRY[roi['type']]:
+            if key == 'points':
+                points = roi.get('points')
+                if not isinstance(points, list) or len(points) < 3 or \
+                        not all(isinstance(point, list) and len(point) == 2 for point in points):
+                    raise ValueError("points 必須是至少三個 [x, y] 座標")
+                for point in points:
+                    roi_number(point[0], 'points')
+                    roi_number(point[1], 'points')
+            else:
+                roi_number(roi.get(key), key)
+
+        if not isinstance(roi.get('name'), str):
+            raise ValueError("name 必須是字串")
+        try:
+            roi['priority'] = int(roi.get('priority', 0))
+        except (TypeError, ValueError):
+            raise ValueError("priority 必須是整數")
+        roi['predictive'] = bool(roi.get('predictive', False))
+        if roi.get('group') is not None and not isinstance(roi['group'], str):
+            raise ValueError("group 必須是字串")
+        if roi.get('retrigger', 'restart') not in RETRIGGER_POLICIES:
+            raise ValueError(f"retrigger 必須是 {' / '.join(RETRIGGER_POLICIES)}")
+        roi['volume'] = float(roi_number(roi.get('volume', 1.0), 'volume'))
+        if not 0 <= roi['volume'] <= 1:
+            raise ValueError("volume 必須介於 0 與 1 之間")
+        roi['cooldown'] = float(roi_number(roi.get('cooldown', 0), 'cooldown'))
+        if roi['cooldown'] < 0:
+            raise ValueError("cooldown 不可為負數")
+        return roi
+    
+    def build_roi(self, roi_data, name):
+        """依輸入資料建立 ROI"""
         roi = {
-            'id': roi_id,
-            'type': roi_data['type'],  # 'rectangle' or 'circle'
-            'x': roi_data['x'],
-            'y': roi_data['y'],
-            'name': roi_data.get('name', f"ROI {len(config['rois']) + 1}"),
+            'id': str(uuid.uuid4()),
+            'type': roi_data.get('type'),  # 'rectangle' / 'circle' / 'polygon'
+            'name': roi_data.get('name') or name,
             'audio_file': roi_data.get('audio_file', ''),
+            'predictive': roi_data.get('predictive', False),  # 打擊類音效：預測觸碰以降低延遲
+            'priority': roi_data.get('priority', 0),          # 聲道不足時優先權低者先被搶佔
+            'group': roi_data.get('group'),                   # 互斥群組 (例如同時只播放一段旁白)
+            'retrigger': roi_data.get('retrigger', 'restart'),  # restart / overlap / ignore
+            'volume': roi_data.get('volume', 1.0),            # 個別音量 (0 ~ 1)，再乘上主音量
+            'cooldown': roi_data.get('cooldown', 0),          # 重複觸發的最短間隔 (秒)，0 表示只去除重複事件
             'created_at': datetime.now().isoformat()
         }
         
-        # 根據類型添加特定屬性
-        if roi['type'] == 'rectangle':
-            roi['width'] = roi_data['width']
-            roi['height'] = roi_data['height']
-        elif roi['type'] == 'circle':
-            roi['radius'] = roi_data['radius']
+        # 根據類型添加幾何屬性 (多邊形只有 points)
+        for key in ROI_GEOMETRY.get(roi['type'], ()):
+            roi[key] = roi_data.get(key)
         
-        config['rois'].append(roi)
-        
-        if self.save_project(project_name, config):
-            return roi
-        return None
+        return self.validate_roi(roi)
     
-    def update_roi(self, project_name, roi_id, roi_data):
-        """更新 ROI"""
-        config = self.load_project(project_name)
-        if not config:
+    def add_roi(self, project_name, roi_data):
+        """新增 ROI"""
+        if not self.repository.exists(project_name):
             return None
         
-        for i, roi in enumerate(config['rois']):
-            if roi['id'] == roi_id:
-                # 更新屬性
-                roi.update(roi_data)
-                roi['modified_at'] = datetime.now().isoformat()
+        name = roi_data.get('name') or f"ROI {len(self.load_project(project_name)['rois']) + 1}"
+        return self.repository.add_roi(project_name, self.build_roi(roi_data, name))
+    
+    def apply_roi_ops(self, project_name, base_version, ops):
+        """批次套用 ROI 操作，回傳 (新版本, 新增的 ROI)
+        
+        ops: [{'op': 'create', 'roi': {...}, 'client_id': ...},
+              {'op': 'update', 'id': ..., 'fields': {...}},
+              {'op': 'delete', 'id': ...}]
+        """
+        now = datetime.now().isoformat()
+        normalized = []
+        client_ids = []
+        current = None
+        for op in ops:
+            if not isinstance(op, dict):
+                raise ValueError("操作必須是物件")
+            if op.get('op') == 'create':
+                if not isinstance(op.get('roi'), dict):
+                    raise ValueError("create 操作需要 roi 物件")
+                client_ids.append(op.get('client_id'))
+                normalized.append({'op': 'create', 'roi': self.build_roi(op['roi'], f"ROI {len(client_ids)}")})
+            elif op.get('op') == 'update':
+                if not isinstance(op.get('fields', {}), dict):
+                    raise ValueError("update 操作的 fields 必須是物件")
+                fields = {key: value for key, value in op.get('fields', {}).items() if key not in ('id', 'created_at')}
                 
-                if self.save_project(project_name, config):
-                    return roi
-                break
+                # 合併至目前的 ROI 後以新增時相同的規則檢查 (版本不符時 repository 會拒絕)
+                if current is None:
+                    project = self.load_project(project_name)
+                    if project is None:
+                        return None
+                    current = {roi['id']: roi for roi in project['rois']}
+                roi = current.get(op['id'])
+                if roi is None:
+                    raise ValueError(f"ROI {op['id']} 不存在")
+                merged = self.validate_roi(dict(roi, **fields))
+                current[op['id']] = merged
+                fields = {key: merged[key] for key in fields}
+                normalized.append({'op': 'update', 'id': op['id'], 'fields': dict(fields, modified_at=now)})
+            else:
+                normalized.append(op)
         
-        return None
+        result = self.repository.apply_roi_ops(project_name, base_version, normalized)
+        if result is None:
+            return None
+        
+        # 回傳前端的暫時 ID，讓編輯器替換為正式 ID
+        version, created = result
+        return version, [dict(roi, client_id=client_id) for roi, client_id in zip(created, client_ids)]
+    
+    def update_roi(self, project_name, roi_id, roi_data, bump_version=True):
+        """更新 ROI (bump_version=False 的衍生欄位不更新修改時間)"""
+        fields = dict(roi_data, modified_at=datetime.now().isoformat()) if bump_version else dict(roi_data)
+        return self.repository.update_roi(project_name, roi_id, fields, bump_version)
     
     def delete_roi(self, project_name, roi_id):
         """刪除 ROI"""
-        config = self.load_project(project_name)
-        if not config:
-            return False
+        return self.repository.delete_roi(project_name, roi_id)
+    
+    def file_digest(self, file_path):
+        """檔案內容的 SHA-256，檔案未變動時使用快取"""
+        stat = os.stat(file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._digest_lock:
+            cached = self._digests.get(file_path)
+        if cached and cached[0] == key:
+            return cached[1]
         
-        config['rois'] = [roi for roi in config['rois'] if roi['id'] != roi_id]
+        digest = file_hash(file_path)
+        with self._digest_lock:
+            self._digests[file_path] = (key, digest)
+        return digest
+    
+    @staticmethod
+    def is_hashed_name(filename):
+        """檔名是否為內容雜湊 (可永久快取)"""
+        return bool(HASHED_NAME.match(os.path.splitext(os.path.basename(filename))[0]))
+    
+    def list_assets(self, project_name):
+        """列出專案素材 (相對路徑、大小、雜湊)"""
+        project_path = os.path.join(self.projects_folder, project_name)
+        if not os.path.isdir(project_path):
+            return None
         
-        return self.save_project(project_name, config)
+        assets = []
+        for root, _, files in os.walk(project_path):
+            for name in sorted(files):
+                if name in INTERNAL_FILES or name.endswith('.tmp'):
+                    continue
+                file_path = os.path.join(root, name)
+                rel_path = os.path.relpath(file_path, project_path).replace(os.sep, '/')
+                assets.append({
+                    'path': rel_path,
+                    'size': os.path.getsize(file_path),
+                    'hash': self.file_digest(file_path),
+                    'immutable': self.is_hashed_name(name)
+                })
+        return assets
     
-    def save_uploaded_file(self, file, project_name=None):
-        """儲存上傳的檔案"""
+    def save_uploaded_file(self, file, project_name=None, kind=None):
+        """儲存上傳的檔案
+        
+        專案素材以內容雜湊命名 (<sha256><副檔名>)，相同內容只儲存一份；
+        副檔名依檔頭判斷，指定 kind ('image' / 'audio') 而類型不符時回傳 None。
+        """
         if file and file.filename:
             filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{timestamp}_{filename}"
             
             if project_name:
-                # 儲存到專案資料夾
+                stream = file.stream
+                if isinstance(stream, HashingUpload):
+                    # 上傳時已串流寫入暫存檔並計算雜湊
+                    stream.finish()
+                    temp_path, digest, file_kind, ext = stream.path, stream.hexdigest(), stream.kind, stream.ext
+                else:
+                    file_kind, ext = sniff(stream.read(16))
+                    stream.seek(0)
+                    temp_path, digest = self.assets.temp_path(), None
+                    file.save(temp_path)
+                
+                if file_kind is None or (kind and file_kind != kind):
+                    os.remove(temp_path)
+                    return None
+                
+                # 納入素材庫並連結到專案資料夾
                 project_path = os.path.join(self.projects_folder, project_name)
-                file_path = os.path.join(project_path, filename)
-            else:
-                # 儲存到上傳資料夾
-                from flask import current_app
-                upload_folder = current_app.config['UPLOAD_FOLDER']
-                file_path = os.path.join(upload_folder, filename)
+                return self.assets.add(temp_path, project_path, ext, digest)
             
-            file.save(file_path)
+            # 儲存到上傳資料夾
+            from flask import current_app
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f"{timestamp}_{filename}"
+            upload_folder = current_app.config['UPLOAD_FOLDER']
+            file.save(os.path.join(upload_folder, filename))
             return filename
         
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,104 @@
+# image_variants.py - 背景圖片縮圖/預覽/列印版本產生模組
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_transcoder import file_hash
+
+VARIANT_FOLDER = 'img'
+
+# 版本名稱 -> (長邊像素上限, JPEG 品質)，依尺寸由小到大排列
+VARIANTS = {
+    'thumb': (320, 80),      # 專案列表縮圖
+    'preview': (1600, 85),   # 編輯器畫布 (800x600，高解析度螢幕為兩倍)
+    'print': (3508, 92)      # A4 300 DPI 列印
+}
+
+
+def pick_variant(variants, width, height):
+    """選擇寬高皆足夠的最小版本，都不夠時回傳最大版本；沒有版本時回傳 None"""
+    if not variants:
+        return None
+    ordered = [variants[name] for name in VARIANTS if name in variants]
+    for variant in ordered:
+        if variant['width'] >= width and variant['height'] >= height:
+            return variant['file']
+    return ordered[-1]['file']
+
+
+def load_image(path):
+    """讀取圖片 (JPEG 依 EXIF 旋轉)，PNG 的透明背景以白色合成"""
+    import cv2
+    import numpy as np
+
+    if path.lower().endswith('.png'):
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    else:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"無法讀取圖片 {os.path.basename(path)}")
+    if image.dtype != np.uint8:
+        image = (image >> 8).astype(np.uint8)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        alpha = image[:, :, 3:4].astype(np.float32) / 255.0
+        return (image[:, :, :3] * alpha + 255 * (1 - alpha)).astype(np.uint8)
+    return image
+
+
+class ImageVariantPipeline:
+    """上傳的背景圖片產生縮圖、編輯器預覽與列印版本
+
+    各版本以來源內容雜湊與版本設定計算檔名，存放於專案的 img 資料夾，
+    相同圖片只處理一次，檔名不變因此可永久快取。
+    """
+
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image')
+
+    def process(self, project_path, filename):
+        """產生所有版本，回傳 {版本: {'file', 'width', 'height'}}"""
+        import cv2
+
+        source_path = os.path.join(project_path, filename)
+        digest = file_hash(source_path)
+        image = load_image(source_path)
+        height, width = image.shape[:2]
+
+        os.makedirs(os.path.join(project_path, VARIANT_FOLDER), exist_ok=True)
+        variants = {}
+        for name, (long_edge, quality) in VARIANTS.items():
+            scale = min(1.0, long_edge / max(width, height))
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            key = hashlib.sha256(f"{digest}:{long_edge}:{quality}".encode()).hexdigest()
+            variant_name = f"{VARIANT_FOLDER}/{key}.jpg"
+            variant_path = os.path.join(project_path, variant_name)
+
+            if not os.path.exists(variant_path):
+                resized = image if scale == 1.0 else cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+                ok, encoded = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                if not ok:
+                    raise ValueError(f"無法編碼 {name} 版本")
+                tmp_path = f"{variant_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(encoded.tobytes())
+                os.replace(tmp_path, variant_path)
+
+            variants[name] = {'file': variant_name, 'width': size[0], 'height': size[1]}
+
+        return variants
+
+    def submit(self, project_path, filename, callback=None):
+        """交由背景工作池處理，完成後呼叫 callback(variants)"""
+        def job():
+            try:
+                variants = self.process(project_path, filename)
+            except Exception as e:
+                print(f"Error processing image {filename}: {e}")
+                return None
+            if callback:
+                callback(variants)
+            return variants
+
+        return self.executor.submit(job)
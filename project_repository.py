@@ -0,0 +1,437 @@
+# project_repository.py - 專案設定存取模組
+import atexit
+import base64
+import bisect
+import copy
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+# 專案摘要索引 (列表頁不需解析每個 config.json)
+SUMMARY_INDEX_FILENAME = '.summary_index.json'
+
+# 列表排序欄位
+SORT_FIELDS = {'created': 'created_at', 'modified': 'modified_at'}
+
+
+class VersionConflict(Exception):
+    """批次修改的版本與目前版本不符"""
+
+    def __init__(self, current_version):
+        super().__init__(f"project version is {current_version}")
+        self.current_version = current_version
+
+
+def apply_roi_ops(rois, ops):
+    """將 create/update/delete 操作套用至 ROI 列表，回傳新增的 ROI"""
+    index = {roi['id']: roi for roi in rois}
+    created = []
+    for op in ops:
+        kind = op.get('op')
+        if kind == 'create':
+            roi = op['roi']
+            if roi['id'] in index:
+                raise ValueError(f"ROI {roi['id']} already exists")
+            rois.append(roi)
+            index[roi['id']] = roi
+            created.append(roi)
+        elif kind == 'update':
+            if op['id'] not in index:
+                raise ValueError(f"ROI {op['id']} not found")
+            index[op['id']].update(op.get('fields', {}))
+        elif kind == 'delete':
+            roi = index.pop(op['id'], None)
+            if roi is not None:
+                rois.remove(roi)
+        else:
+            raise ValueError(f"unknown op: {kind}")
+    return created
+
+
+def project_summary(project_id, config):
+    """專案列表所需的摘要欄位"""
+    return {
+        'id': project_id,
+        'name': config.get('name'),
+        'created_at': config.get('created_at') or '',
+        'modified_at': config.get('modified_at') or config.get('created_at') or '',
+        'background_image': config.get('background_image'),
+        'thumbnail': (config.get('background_variants') or {}).get('thumb', {}).get('file'),
+        'roi_count': len(config.get('rois', [])),
+        'version': config.get('version', 0)
+    }
+
+
+def encode_cursor(sort_value, project_id):
+    return base64.urlsafe_b64encode(json.dumps([sort_value, project_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解析分頁游標，格式錯誤時拋出 ValueError"""
+    try:
+        sort_value, project_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('invalid cursor')
+    if not isinstance(sort_value, str) or not isinstance(project_id, str):
+        raise ValueError('invalid cursor')
+    return sort_value, project_id
+
+
+class ProjectRepository:
+    """專案 config.json 的記憶體快取
+
+    已解析的設定以 (mtime_ns, 大小) 為版本，檔案被外部修改時自動重新讀取；
+    透過此類別寫入的變更直接更新快取。專案列表以資料夾 mtime 判斷新增/刪除，
+    各專案的版本最多每 revalidate_interval 秒檢查一次。
+
+    寫入採延遲合併：save 立即更新記憶體，write_delay 秒內的多次變更
+    合併為一次原子寫入 (暫存檔 + fsync + rename)，寫入失敗時每
+    retry_delay 秒重試。flush 會等待所有變更寫入磁碟，程式結束時自動呼叫。
+
+    專案摘要 (名稱、日期、ROI 數量) 另存為索引檔並隨設定更新，
+    列表時只需 stat 檢查變動，不必重新解析每個 config.json。
+    """
+
+    def __init__(self, projects_folder, revalidate_interval=2.0, write_delay=0.2, retry_delay=5.0):
+        self.projects_folder = projects_folder
+        self.revalidate_interval = revalidate_interval
+        self.write_delay = write_delay
+        self.retry_delay = retry_delay  # 寫入失敗後重試的間隔 (秒)
+        self._configs = {}           # project_id -> (簽章, config)，未寫入時簽章為 None
+        self._dirty = set()
+        self._timer = None
+        self._folder_mtime = None
+        self._project_ids = []
+        self._last_validated = 0
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+
+        self._summaries = self._read_summary_index()  # project_id -> (簽章, 摘要)
+        self._index_dirty = False
+        # 各排序欄位依 (欄位值, project_id) 遞增排列的鍵，分頁時以二分搜尋定位游標
+        self._sorted = {field: sorted((summary[field], project_id)
+                                      for project_id, (_, summary) in self._summaries.items())
+                        for field in SORT_FIELDS.values()}
+        self.change_listeners = []   # listener(project_id, config)，刪除時 config 為 None
+        atexit.register(self.flush)
+
+    def _read_summary_index(self):
+        try:
+            with open(os.path.join(self.projects_folder, SUMMARY_INDEX_FILENAME), 'r', encoding='utf-8') as f:
+                return {project_id: (tuple(signature) if signature else None, summary)
+                        for project_id, (signature, summary) in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def _write_summary_index(self):
+        with self._index_lock:
+            with self._lock:
+                if not self._index_dirty:
+                    return
+                data = json.dumps({project_id: [signature, summary]
+                                   for project_id, (signature, summary) in self._summaries.items()
+                                   if signature is not None}, ensure_ascii=False)
+                self._index_dirty = False
+            try:
+                self._write_atomic(os.path.join(self.projects_folder, SUMMARY_INDEX_FILENAME), data)
+            except OSError as e:
+                print(f"Error saving project index: {e}")
+
+    def add_change_listener(self, listener):
+        """註冊專案變更通知 (例如搜尋索引)"""
+        self.change_listeners.append(listener)
+
+    def _sort_summary(self, project_id, old_summary, new_summary):
+        """更新各排序欄位的鍵 (新增時 old_summary 為 None，刪除時 new_summary 為 None)"""
+        for field, keys in self._sorted.items():
+            if old_summary is not None:
+                key = (old_summary[field], project_id)
+                i = bisect.bisect_left(keys, key)
+                if i < len(keys) and keys[i] == key:
+                    del keys[i]
+            if new_summary is not None:
+                bisect.insort(keys, (new_summary[field], project_id))
+
+    def _cache(self, project_id, signature, config):
+        """更新設定快取與摘要索引"""
+        changed = self._configs.get(project_id, (None, None))[1] is not config
+        self._configs[project_id] = (signature, config)
+        summary = project_summary(project_id, config)
+        old = self._summaries.get(project_id)
+        self._sort_summary(project_id, old[1] if old else None, summary)
+        self._summaries[project_id] = (signature, summary)
+        self._index_dirty = True
+        if changed:
+            for listener in self.change_listeners:
+                listener(project_id, config)
+
+    def config_path(self, project_id):
+        return os.path.join(self.projects_folder, project_id, 'config.json')
+
+    @staticmethod
+    def _signature(config_path):
+        stat = os.stat(config_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, project_id):
+        """回傳快取中的設定，檔案有變動時重新讀取"""
+        cached = self._configs.get(project_id)
+        if cached and cached[0] is None:
+            # 尚未寫入磁碟，以記憶體為準
+            return cached[1]
+
+        config_path = self.config_path(project_id)
+        try:
+            signature = self._signature(config_path)
+        except OSError:
+            self._configs.pop(project_id, None)
+            return None
+
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading project {project_id}: {e}")
+            return None
+
+        self._cache(project_id, signature, config)
+        return config
+
+    def get(self, project_id):
+        """取得專案設定 (複本，可自由修改後再 save)"""
+        with self._lock:
+            config = self._load(project_id)
+            return copy.deepcopy(config) if config is not None else None
+
+    def exists(self, project_id):
+        with self._lock:
+            return self._load(project_id) is not None
+
+    def _refresh_ids(self):
+        """專案資料夾有變動時重新列出專案，回傳是否需要重新檢查各專案版本"""
+        try:
+            folder_mtime = os.stat(self.projects_folder).st_mtime_ns
+        except OSError:
+            self._project_ids = []
+            return False
+
+        if folder_mtime != self._folder_mtime:
+            self._folder_mtime = folder_mtime
+            self._project_ids = sorted(
+                name for name in os.listdir(self.projects_folder)
+                if name in self._dirty or os.path.isfile(self.config_path(name)))
+            self._last_validated = 0
+
+        now = time.time()
+        if now - self._last_validated >= self.revalidate_interval:
+            self._last_validated = now
+            return True
+        return False
+
+    def list(self):
+        """列出所有專案設定 (淺複本)"""
+        with self._lock:
+            if self._refresh_ids():
+                for project_id in self._project_ids:
+                    self._load(project_id)
+
+            projects = []
+            for project_id in self._project_ids:
+                cached = self._configs.get(project_id)
+                if cached:
+                    projects.append((project_id, dict(cached[1])))
+            return projects
+
+    def _validate_summaries(self):
+        """重新解析有變動的設定 (需持有 _lock)"""
+        if self._refresh_ids():
+            for project_id in self._project_ids:
+                cached = self._summaries.get(project_id)
+                if cached and cached[0] is None:
+                    continue
+                try:
+                    signature = self._signature(self.config_path(project_id))
+                except OSError:
+                    continue
+                if not cached or cached[0] != signature:
+                    self._load(project_id)
+
+    def list_summaries(self, sort='created', limit=20, cursor=None):
+        """依排序欄位由新到舊分頁，回傳 (本頁摘要, 下一頁游標)
+
+        各欄位的鍵已預先排序，以二分搜尋找到游標位置後往前取 limit 筆，
+        不需每次排序所有專案。
+        """
+        field = SORT_FIELDS[sort]
+        after = tuple(decode_cursor(cursor)) if cursor else None
+        with self._lock:
+            self._validate_summaries()
+            keys = self._sorted[field]
+            project_ids = set(self._project_ids)
+            pos = bisect.bisect_left(keys, after) if after else len(keys)
+
+            page = []
+            while pos > 0 and len(page) <= limit:
+                pos -= 1
+                project_id = keys[pos][1]
+                # 已在外部刪除的專案仍留在索引中，略過
+                if project_id in project_ids:
+                    page.append(dict(self._summaries[project_id][1]))
+
+        self._write_summary_index()
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1][field], page[-1]['id'])
+        return page, next_cursor
+
+    def save(self, project_id, config, bump_version=True):
+        """更新專案設定，稍後合併寫入磁碟
+
+        bump_version=False 用於不影響編輯內容的衍生欄位 (例如轉檔結果)，
+        不會使編輯器的批次修改產生版本衝突，也不更新修改時間。
+        """
+        config = {key: value for key, value in config.items() if key not in ('id', 'folder_name')}
+        with self._lock:
+            current = self._load(project_id)
+            config['version'] = (current or config).get('version', 0) + (1 if bump_version else 0)
+            if bump_version or current is None:
+                config['modified_at'] = datetime.now().isoformat()
+            else:
+                config['modified_at'] = current.get('modified_at')
+            os.makedirs(os.path.join(self.projects_folder, project_id), exist_ok=True)
+            self._cache(project_id, None, copy.deepcopy(config))
+            self._dirty.add(project_id)
+            self._schedule_flush(self.write_delay)
+        return True
+
+    def _schedule_flush(self, delay):
+        """delay 秒後寫入 (已排程時沿用原排程)"""
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """將所有未寫入的變更寫入磁碟 (完成後才返回)"""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                pending = {project_id: json.dumps(self._configs[project_id][1], ensure_ascii=False, indent=2)
+                           for project_id in self._dirty}
+                self._dirty.clear()
+
+            for project_id, data in pending.items():
+                config_path = self.config_path(project_id)
+                try:
+                    self._write_atomic(config_path, data)
+                except OSError as e:
+                    print(f"Error saving project {project_id}: {e}")
+                    # 保留變更並稍後重試，不必等到下一次 save
+                    with self._lock:
+                        self._dirty.add(project_id)
+                        self._schedule_flush(self.retry_delay)
+                    continue
+
+                with self._lock:
+                    cached = self._configs.get(project_id)
+                    if cached and project_id not in self._dirty:
+                        self._cache(project_id, self._signature(config_path), cached[1])
+
+            self._write_summary_index()
+
+    @staticmethod
+    def _write_atomic(path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def update_project(self, project_id, fields, bump_version=True):
+        """更新專案屬性 (不含 ROI)"""
+        with self._lock:
+            config = self.get(project_id)
+            if config is None:
+                return None
+            config.update(fields)
+            self.save(project_id, config, bump_version)
+            return config
+
+    def add_roi(self, project_id, roi):
+        with self._lock:
+            config = self.get(project_id)
+            if config is None:
+                return None
+            config['rois'].append(roi)
+            self.save(project_id, config)
+            return roi
+
+    def update_roi(self, project_id, roi_id, fields, bump_version=True):
+        with self._lock:
+            config = self.get(project_id)
+            if config is None:
+                return None
+            for roi in config['rois']:
+                if roi['id'] == roi_id:
+                    roi.update(fields)
+                    self.save(project_id, config, bump_version)
+                    return roi
+            return None
+
+    def delete_roi(self, project_id, roi_id):
+        with self._lock:
+            config = self.get(project_id)
+            if config is None:
+                return False
+            config['rois'] = [roi for roi in config['rois'] if roi['id'] != roi_id]
+            self.save(project_id, config)
+            return True
+
+    def apply_roi_ops(self, project_id, base_version, ops):
+        """以單一版本套用多個 ROI 操作，版本不符時拋出 VersionConflict"""
+        with self._lock:
+            config = self.get(project_id)
+            if config is None:
+                return None
+            if config.get('version', 0) != base_version:
+                raise VersionConflict(config.get('version', 0))
+            created = apply_roi_ops(config['rois'], ops)
+            self.save(project_id, config)
+            return self._configs[project_id][1]['version'], created
+
+    def publish(self, project_id):
+        """確保 config.json 為最新 (檢測器與音效派送直接讀取檔案)"""
+        self.flush()
+
+    def delete(self, project_id):
+        """刪除專案資料夾"""
+        with self._flush_lock, self._lock:
+            self._dirty.discard(project_id)
+            shutil.rmtree(os.path.join(self.projects_folder, project_id))
+            self._configs.pop(project_id, None)
+            old = self._summaries.pop(project_id, None)
+            if old:
+                self._sort_summary(project_id, old[1], None)
+            self._index_dirty = True
+            for listener in self.change_listeners:
+                listener(project_id, None)
+
+
+def open_repository(projects_folder):
+    """依環境變數選擇儲存方式：TOUCHHEAR_STORAGE=sqlite 使用 SQLite，預設為 JSON 檔案"""
+    if os.environ.get('TOUCHHEAR_STORAGE') == 'sqlite':
+        from sqlite_store import SQLiteProjectStore
+        db_path = os.environ.get('TOUCHHEAR_DB', os.path.join(projects_folder, 'projects.db'))
+        return SQLiteProjectStore(projects_folder, db_path)
+    return ProjectRepository(projects_folder)
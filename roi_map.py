@@ -0,0 +1,202 @@
+# roi_map.py - ROI 標籤圖模組
+import json
+import os
+
+import cv2
+import numpy as np
+
+# A4 參考尺寸 (210mm x 297mm)
+A4_WIDTH_MM = 210
+A4_HEIGHT_MM = 297
+
+# 編輯器畫布尺寸 (ROI 座標以此為單位儲存)
+EDITOR_CANVAS_SIZE = (800, 600)
+
+LABEL_MAP_FILENAME = 'roi_labels.npy'
+LABEL_META_FILENAME = 'roi_labels.json'
+
+
+def roi_to_a4_polygon(roi, canvas_size=EDITOR_CANVAS_SIZE):
+    """將編輯器 ROI 轉換為 A4 毫米座標多邊形"""
+    sx = A4_WIDTH_MM / canvas_size[0]
+    sy = A4_HEIGHT_MM / canvas_size[1]
+    roi_type = roi.get('type', 'rectangle')
+
+    if roi_type == 'rectangle':
+        x, y = roi['x'] * sx, roi['y'] * sy
+        w, h = roi['width'] * sx, roi['height'] * sy
+        return [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+
+    if roi_type == 'circle':
+        # x, y 為外接矩形左上角 (與 render_project_image 相同)
+        cx = (roi['x'] + roi['radius']) * sx
+        cy = (roi['y'] + roi['radius']) * sy
+        rx, ry = roi['radius'] * sx, roi['radius'] * sy
+        angles = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+        return list(zip(cx + rx * np.cos(angles), cy + ry * np.sin(angles)))
+
+    if roi_type == 'polygon':
+        return [(px * sx, py * sy) for px, py in roi['points']]
+
+    return None
+
+
+class ROILabelMap:
+    """A4 紙面上的 ROI 標籤圖 (uint16，0 表示無 ROI)"""
+
+    def __init__(self, labels, rois, resolution):
+        self.labels = labels
+        self.rois = rois
+        self.resolution = resolution
+
+    @classmethod
+    def render(cls, rois, resolution=1.0, canvas_size=EDITOR_CANVAS_SIZE):
+        """將 ROI 繪製成標籤圖，後面的 ROI 覆蓋前面的 (最上層優先)"""
+        height = int(np.ceil(A4_HEIGHT_MM / resolution))
+        width = int(np.ceil(A4_WIDTH_MM / resolution))
+        labels = np.zeros((height, width), dtype=np.uint16)
+
+        mapped_rois = []
+        for roi in rois:
+            polygon = roi_to_a4_polygon(roi, canvas_size)
+            if not polygon or len(mapped_rois) >= np.iinfo(np.uint16).max - 1:
+                continue
+            mapped_rois.append(roi)
+            points = np.round(np.array(polygon, dtype=np.float64) / resolution).astype(np.int32)
+            cv2.fillPoly(labels, [points], len(mapped_rois))
+
+        return cls(labels, mapped_rois, resolution)
+
+    def lookup(self, a4_coord):
+        """以 A4 座標 (mm) 查詢所在的 ROI"""
+        if a4_coord is None:
+            return None
+
+        col = int(a4_coord[0] / self.resolution)
+        row = int(a4_coord[1] / self.resolution)
+        if not (0 <= row < self.labels.shape[0] and 0 <= col < self.labels.shape[1]):
+            return None
+
+        label = int(self.labels[row, col])
+        return self.rois[label - 1] if label else None
+
+    @staticmethod
+    def config_signature(config_path):
+        """config.json 的版本簽章 (mtime + 大小)"""
+        stat = os.stat(config_path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    @classmethod
+    def for_project(cls, project_path, resolution=1.0, canvas_size=EDITOR_CANVAS_SIZE):
+        """載入專案標籤圖，config.json 有變動時才重新產生
+
+        標籤圖以 .npy 儲存於專案資料夾並以 mmap 唯讀開啟，
+        多個行程可共用同一份記憶體。
+        """
+        config_path = os.path.join(project_path, 'config.json')
+        map_path = os.path.join(project_path, LABEL_MAP_FILENAME)
+        meta_path = os.path.join(project_path, LABEL_META_FILENAME)
+
+        signature = cls.config_signature(config_path)
+
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['signature'] == signature and meta['resolution'] == resolution:
+                labels = np.load(map_path, mmap_mode='r')
+                return cls(labels, meta['rois'], resolution)
+        except (OSError, ValueError, KeyError):
+            pass
+
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        label_map = cls.render(config.get('rois', []), resolution, canvas_size)
+        label_map.save(project_path, signature)
+        label_map.labels = np.load(map_path, mmap_mode='r')
+        return label_map
+
+    def save(self, project_path, signature):
+        """原子寫入標籤圖與中繼資料"""
+        map_path = os.path.join(project_path, LABEL_MAP_FILENAME)
+        meta_path = os.path.join(project_path, LABEL_META_FILENAME)
+        pid = os.getpid()
+
+        tmp_map = f"{map_path}.{pid}.tmp"
+        with open(tmp_map, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.labels))
+        os.replace(tmp_map, map_path)
+
+        tmp_meta = f"{meta_path}.{pid}.tmp"
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump({
+                'signature': signature,
+                'resolution': self.resolution,
+                'rois': self.rois
+            }, f, ensure_ascii=False)
+        os.replace(tmp_meta, meta_path)
+
+
+class ROITouchResolver:
+    """在檢測迴圈中將觸碰座標解析為 ROI，並記錄停留時間"""
+
+    def __init__(self, resolution=1.0, reload_interval=1.0):
+        self.resolution = resolution
+        self.reload_interval = reload_interval
+        self.project_id = None
+        self.project_path = None
+        self.label_map = None
+        self.signature = None
+        self.touch_started = {}
+        self.last_checked = 0
+
+    def set_project(self, project_id, project_path):
+        """設定目前播放的專案"""
+        self.project_id = project_id
+        self.project_path = project_path
+        self.touch_started = {}
+        self.label_map = None
+        self.signature = None
+        self.last_checked = 0
+
+    def refresh(self, now):
+        """定期檢查 config.json 是否變動"""
+        if self.project_path is None or now - self.last_checked < self.reload_interval:
+            return
+        self.last_checked = now
+
+        try:
+            signature = ROILabelMap.config_signature(os.path.join(self.project_path, 'config.json'))
+            if self.label_map is not None and signature == self.signature:
+                return
+            self.label_map = ROILabelMap.for_project(self.project_path, self.resolution)
+            self.signature = signature
+        except Exception as e:
+            print(f"Error loading ROI map for {self.project_id}: {e}")
+            self.label_map = None
+
+    def lookup(self, a4_coord):
+        """查詢 A4 座標所在的 ROI"""
+        return self.label_map.lookup(a4_coord) if self.label_map is not None else None
+
+    def resolve(self, a4_coords, now):
+        """解析本幀觸碰的 ROI (含停留時間)"""
+        self.refresh(now)
+        if self.label_map is None:
+            self.touch_started = {}
+            return []
+
+        touched = {}
+        for a4_coord in a4_coords:
+            roi = self.label_map.lookup(a4_coord)
+            if roi is not None and roi['id'] not in touched:
+                touched[roi['id']] = roi
+
+        self.touch_started = {roi_id: self.touch_started.get(roi_id, now) for roi_id in touched}
+
+        return [{
+            "id": roi['id'],
+            "name": roi.get('name'),
+            "audio_file": roi.get('audio_file'),
+            "dwell_time": round(now - self.touch_started[roi_id], 3)
+        } for roi_id, roi in touched.items()]
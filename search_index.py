@@ -0,0 +1,163 @@
+# search_index.py - 專案搜尋索引模組
+import bisect
+import re
+import threading
+
+# 中日韓文字 (不以空白分詞，改用單字與雙字詞)
+CJK_PATTERN = r'぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+TOKEN_RE = re.compile(rf'\d{{4}}-\d{{2}}(?:-\d{{2}})?|[{CJK_PATTERN}]+|[0-9a-z]+')
+CJK_RE = re.compile(rf'[{CJK_PATTERN}]')
+DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})')
+
+# 欄位權重：專案名稱 > ROI 名稱 > 音效檔名 > 日期
+FIELD_WEIGHTS = {'name': 8, 'roi': 4, 'audio': 2, 'date': 1}
+
+
+def tokenize(text):
+    """中日韓文字切成單字與相鄰雙字，其他文字以英數字詞切分 (不分大小寫)"""
+    tokens = []
+    for run in TOKEN_RE.findall((text or '').lower()):
+        if CJK_RE.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def query_tokens(text):
+    """查詢字串的詞：中日韓文字有雙字詞時只比對雙字詞 (較精確)"""
+    tokens = []
+    for run in TOKEN_RE.findall((text or '').lower()):
+        if CJK_RE.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def date_tokens(value):
+    """日期以年、年-月、年-月-日建立索引"""
+    match = DATE_RE.match(value or '')
+    if not match:
+        return []
+    year, month, day = match.groups()
+    return [year, f"{year}-{month}", f"{year}-{month}-{day}"]
+
+
+class SearchIndex:
+    """專案名稱、ROI 名稱、音效檔名與日期的倒排索引
+
+    每次儲存專案時以 index_project 增量更新，查詢只讀取倒排表，
+    不需掃描 config.json。英數字查詢的最後一個詞以前綴比對。
+    """
+
+    def __init__(self):
+        self.postings = {}     # 詞 -> {(專案, ROI 或 None, 欄位): 次數}
+        self.documents = {}    # 專案 -> {'name', 'created_at', 'rois', 'keys'}
+        self._vocabulary = None
+        self._lock = threading.RLock()
+
+    def _fields(self, project_id, config):
+        """產生 (索引鍵, 文字詞) 列表"""
+        entries = [((project_id, None, 'name'), tokenize(config.get('name')))]
+        for field in ('created_at', 'modified_at'):
+            entries.append(((project_id, None, 'date'), date_tokens(config.get(field))))
+        for roi in config.get('rois', []):
+            entries.append(((project_id, roi['id'], 'roi'), tokenize(roi.get('name'))))
+            entries.append(((project_id, roi['id'], 'audio'), tokenize(roi.get('audio_name') or roi.get('audio_file'))))
+        return entries
+
+    def index_project(self, project_id, config):
+        """更新單一專案的索引 (config 為 None 時移除)"""
+        with self._lock:
+            self.remove_project(project_id)
+            if config is None:
+                return
+
+            keys = set()
+            for key, tokens in self._fields(project_id, config):
+                for token in tokens:
+                    posting = self.postings.get(token)
+                    if posting is None:
+                        posting = self.postings[token] = {}
+                        self._vocabulary = None
+                    posting[key] = posting.get(key, 0) + 1
+                    keys.add((token, key))
+
+            self.documents[project_id] = {
+                'name': config.get('name'),
+                'created_at': config.get('created_at'),
+                'rois': {roi['id']: roi.get('name') for roi in config.get('rois', [])},
+                'keys': keys
+            }
+
+    def remove_project(self, project_id):
+        with self._lock:
+            document = self.documents.pop(project_id, None)
+            if document is None:
+                return
+            for token, key in document['keys']:
+                posting = self.postings.get(token)
+                if posting is None:
+                    continue
+                posting.pop(key, None)
+                if not posting:
+                    del self.postings[token]
+                    self._vocabulary = None
+
+    def _prefix_matches(self, prefix):
+        """以排序後的詞彙表做前綴比對"""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        matches = []
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
+
+    def search(self, query, limit=20):
+        """搜尋專案，所有查詢詞都需符合 (AND)，依欄位權重排序"""
+        tokens = query_tokens(query)
+        if not tokens:
+            return []
+
+        with self._lock:
+            scores = None
+            hits = {}
+            for i, token in enumerate(tokens):
+                candidates = [token]
+                if i == len(tokens) - 1 and not CJK_RE.match(token):
+                    candidates = self._prefix_matches(token)
+
+                token_scores = {}
+                for candidate in candidates:
+                    for key, count in self.postings.get(candidate, {}).items():
+                        project_id = key[0]
+                        token_scores[project_id] = token_scores.get(project_id, 0) + FIELD_WEIGHTS[key[2]] * count
+                        hits.setdefault(project_id, set()).add(key)
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {project_id: score + token_scores[project_id]
+                              for project_id, score in scores.items() if project_id in token_scores}
+                if not scores:
+                    return []
+
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], self.documents[item[0]]['name'] or ''))
+            results = []
+            for project_id, score in ranked[:limit]:
+                document = self.documents[project_id]
+                roi_ids = sorted({key[1] for key in hits[project_id] if key[1] is not None})
+                results.append({
+                    'id': project_id,
+                    'name': document['name'],
+                    'created_at': document['created_at'],
+                    'score': score,
+                    'fields': sorted({key[2] for key in hits[project_id]}),
+                    'rois': [{'id': roi_id, 'name': document['rois'].get(roi_id)} for roi_id in roi_ids]
+                })
+            return results
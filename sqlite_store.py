@@ -0,0 +1,389 @@
+# sqlite_store.py - SQLite 專案儲存模組
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from project_repository import (ProjectRepository, VersionConflict, apply_roi_ops,
+                                SORT_FIELDS, decode_cursor, encode_cursor)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT '',
+    modified_at TEXT NOT NULL DEFAULT '',
+    background_image TEXT,
+    version INTEGER NOT NULL DEFAULT 1,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_projects_created ON projects (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_projects_modified ON projects (modified_at, id);
+
+-- ROI ID 只在專案內唯一 (複製的專案資料夾有相同的 ROI ID)
+CREATE TABLE IF NOT EXISTS rois (
+    id TEXT NOT NULL,
+    project_id TEXT NOT NULL REFERENCES projects (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (project_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_rois_project ON rois (project_id, position);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+-- 素材引用改由 AssetStore (projects/.assets/refs.json) 記錄
+DROP TABLE IF EXISTS assets;
+"""
+
+# 舊版資料庫的 rois 以 id 為主鍵，改為 (project_id, id)
+UPGRADE_ROIS = """
+ALTER TABLE rois RENAME TO rois_old;
+DROP INDEX IF EXISTS idx_rois_project;
+CREATE TABLE rois (
+    id TEXT NOT NULL,
+    project_id TEXT NOT NULL REFERENCES projects (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (project_id, id)
+);
+INSERT INTO rois (id, project_id, position, data) SELECT id, project_id, position, data FROM rois_old;
+DROP TABLE rois_old;
+CREATE INDEX IF NOT EXISTS idx_rois_project ON rois (project_id, position);
+"""
+
+# 專案設定中有獨立欄位的屬性，其餘存於 extra
+PROJECT_COLUMNS = ('name', 'created_at', 'modified_at', 'background_image')
+
+
+class SQLiteProjectStore:
+    """以 SQLite (WAL 模式) 儲存專案，與 ProjectRepository 介面相同
+
+    專案與 ROI 各自一張表並建立索引，列表與單一 ROI 的新增/修改/刪除
+    只需一次索引查詢或單列寫入。首次開啟時自動匯入既有的 projects/*/config.json。
+    上傳素材的引用由 AssetStore 管理，與儲存方式無關。
+
+    檢測器與音效派送仍讀取 config.json，publish 過的專案 (播放中) 在變更後
+    會以延遲合併的原子寫入同步輸出 config.json。
+    """
+
+    def __init__(self, projects_folder, db_path, write_delay=0.2, retry_delay=5.0):
+        self.projects_folder = projects_folder
+        self.db_path = db_path
+        self.write_delay = write_delay
+        self.retry_delay = retry_delay  # 輸出失敗後重試的間隔 (秒)
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+
+        # 需要同步輸出 config.json 的專案
+        self._published = set()
+        self._pending = set()
+        self._timer = None
+        self.change_listeners = []   # listener(project_id, config)，刪除時 config 為 None
+
+        with self._write_lock, self._conn() as conn:
+            conn.executescript(SCHEMA)
+            primary_key = [row[1] for row in conn.execute("PRAGMA table_info(rois)") if row[5]]
+            if primary_key == ['id']:
+                conn.executescript(UPGRADE_ROIS)
+            migrated = conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone() is not None
+        if not migrated:
+            self.migrate_from_json()
+
+    def _conn(self):
+        """每個執行緒各自的連線"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def migrate_from_json(self):
+        """匯入既有的 JSON 專案 (單一交易，完成後記錄於 meta)
+
+        已存在於資料庫的專案不會被覆寫，中斷後重新執行只匯入尚未匯入的專案；
+        個別專案匯入失敗時記錄錯誤並略過，不影響其他專案。
+        """
+        count = 0
+        with self._write_lock, self._conn() as conn:
+            existing = {row[0] for row in conn.execute("SELECT id FROM projects")}
+            names = sorted(os.listdir(self.projects_folder)) if os.path.isdir(self.projects_folder) else []
+            for project_id in names:
+                config_path = os.path.join(self.projects_folder, project_id, 'config.json')
+                if project_id in existing or not os.path.isfile(config_path):
+                    continue
+                try:
+                    with open(config_path, 'r', encoding='utf-8') as f:
+                        config = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"Error migrating project {project_id}: {e}")
+                    continue
+
+                conn.execute("SAVEPOINT migrate_project")
+                try:
+                    self._write_project(conn, project_id, config)
+                    count += 1
+                except (sqlite3.Error, KeyError, TypeError) as e:
+                    conn.execute("ROLLBACK TO migrate_project")
+                    print(f"Error migrating project {project_id}: {e}")
+                finally:
+                    conn.execute("RELEASE migrate_project")
+
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                         (datetime.now().isoformat(),))
+
+        print(f"✓ 已匯入 {count} 個專案至 {self.db_path}")
+        return count
+
+    # 讀取
+
+    @staticmethod
+    def _project_from_row(row, rois):
+        config = json.loads(row[6])
+        config.update({
+            'name': row[1],
+            'created_at': row[2],
+            'background_image': row[4],
+            'version': row[5],
+            'rois': rois
+        })
+        if row[3]:
+            config['modified_at'] = row[3]
+        return config
+
+    def get(self, project_id):
+        conn = self._conn()
+        row = conn.execute("SELECT * FROM projects WHERE id = ?", (project_id,)).fetchone()
+        if row is None:
+            return None
+        rois = [json.loads(data) for (data,) in conn.execute(
+            "SELECT data FROM rois WHERE project_id = ? ORDER BY position", (project_id,))]
+        return self._project_from_row(row, rois)
+
+    def exists(self, project_id):
+        return self._conn().execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone() is not None
+
+    def list(self):
+        conn = self._conn()
+        rois = {}
+        for project_id, data in conn.execute("SELECT project_id, data FROM rois ORDER BY project_id, position"):
+            rois.setdefault(project_id, []).append(json.loads(data))
+        return [(row[0], self._project_from_row(row, rois.get(row[0], [])))
+                for row in conn.execute("SELECT * FROM projects ORDER BY id")]
+
+    def list_summaries(self, sort='created', limit=20, cursor=None):
+        """以索引分頁查詢專案摘要，回傳 (本頁摘要, 下一頁游標)"""
+        field = SORT_FIELDS[sort]
+        query = f"""SELECT id, name, created_at, modified_at, background_image, version,
+                          (SELECT COUNT(*) FROM rois WHERE rois.project_id = projects.id),
+                          json_extract(extra, '$.background_variants.thumb.file')
+                   FROM projects"""
+        params = []
+        if cursor:
+            query += f" WHERE ({field}, id) < (?, ?)"
+            params.extend(decode_cursor(cursor))
+        query += f" ORDER BY {field} DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._conn().execute(query, params).fetchall()
+        summaries = [{
+            'id': row[0],
+            'name': row[1],
+            'created_at': row[2],
+            'modified_at': row[3],
+            'background_image': row[4],
+            'thumbnail': row[7],
+            'version': row[5],
+            'roi_count': row[6]
+        } for row in rows[:limit]]
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = summaries[-1]
+            next_cursor = encode_cursor(last[field], last['id'])
+        return summaries, next_cursor
+
+    # 寫入
+
+    def _write_project(self, conn, project_id, config, bump_version=True):
+        extra = {key: value for key, value in config.items()
+                 if key not in PROJECT_COLUMNS and key not in ('id', 'folder_name', 'rois', 'version')}
+        conn.execute(
+            """INSERT INTO projects (id, name, created_at, modified_at, background_image, extra)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (id) DO UPDATE SET name = excluded.name, created_at = excluded.created_at,
+                   modified_at = excluded.modified_at, background_image = excluded.background_image,
+                   extra = excluded.extra, version = version + ?""",
+            (project_id, config.get('name', project_id), config.get('created_at') or '',
+             config.get('modified_at') or config.get('created_at') or '',
+             config.get('background_image'), json.dumps(extra, ensure_ascii=False), 1 if bump_version else 0))
+        conn.execute("DELETE FROM rois WHERE project_id = ?", (project_id,))
+        conn.executemany(
+            "INSERT INTO rois (id, project_id, position, data) VALUES (?, ?, ?, ?)",
+            [(roi['id'], project_id, i, json.dumps(roi, ensure_ascii=False))
+             for i, roi in enumerate(config.get('rois', []))])
+
+    def _touch(self, conn, project_id, bump_version=True):
+        """使用者編輯時更新修改時間與版本 (提交後由呼叫端通知 _changed)"""
+        if bump_version:
+            conn.execute("UPDATE projects SET modified_at = ?, version = version + 1 WHERE id = ?",
+                         (datetime.now().isoformat(), project_id))
+
+    def save(self, project_id, config, bump_version=True):
+        os.makedirs(os.path.join(self.projects_folder, project_id), exist_ok=True)
+        # 衍生欄位 (bump_version=False) 沿用原本的修改時間
+        if bump_version or not config.get('modified_at'):
+            config = dict(config, modified_at=datetime.now().isoformat())
+        with self._write_lock, self._conn() as conn:
+            self._write_project(conn, project_id, config, bump_version)
+        self._changed(project_id)
+        return True
+
+    def update_project(self, project_id, fields, bump_version=True):
+        with self._write_lock:
+            config = self.get(project_id)
+            if config is None:
+                return None
+            config.update(fields)
+            self.save(project_id, config, bump_version)
+            return config
+
+    def add_roi(self, project_id, roi):
+        with self._write_lock, self._conn() as conn:
+            if not self.exists(project_id):
+                return None
+            position = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM rois WHERE project_id = ?",
+                                    (project_id,)).fetchone()[0]
+            conn.execute("INSERT INTO rois (id, project_id, position, data) VALUES (?, ?, ?, ?)",
+                         (roi['id'], project_id, position, json.dumps(roi, ensure_ascii=False)))
+            self._touch(conn, project_id)
+        self._changed(project_id)
+        return roi
+
+    def update_roi(self, project_id, roi_id, fields, bump_version=True):
+        with self._write_lock, self._conn() as conn:
+            row = conn.execute("SELECT data FROM rois WHERE id = ? AND project_id = ?",
+                               (roi_id, project_id)).fetchone()
+            if row is None:
+                return None
+            roi = json.loads(row[0])
+            roi.update(fields)
+            conn.execute("UPDATE rois SET data = ? WHERE id = ? AND project_id = ?",
+                         (json.dumps(roi, ensure_ascii=False), roi_id, project_id))
+            self._touch(conn, project_id, bump_version)
+        self._changed(project_id)
+        return roi
+
+    def delete_roi(self, project_id, roi_id):
+        with self._write_lock, self._conn() as conn:
+            if not self.exists(project_id):
+                return False
+            conn.execute("DELETE FROM rois WHERE id = ? AND project_id = ?", (roi_id, project_id))
+            self._touch(conn, project_id)
+        self._changed(project_id)
+        return True
+
+    def apply_roi_ops(self, project_id, base_version, ops):
+        """在單一交易中套用多個 ROI 操作，版本不符時拋出 VersionConflict"""
+        with self._write_lock, self._conn() as conn:
+            row = conn.execute("SELECT version FROM projects WHERE id = ?", (project_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] != base_version:
+                raise VersionConflict(row[0])
+
+            positions = {}
+            rois = []
+            for roi_id, position, data in conn.execute(
+                    "SELECT id, position, data FROM rois WHERE project_id = ? ORDER BY position", (project_id,)):
+                positions[roi_id] = position
+                rois.append(json.loads(data))
+            created = apply_roi_ops(rois, ops)
+
+            # 只寫入有變動的列，新增的 ROI 排在最後
+            next_position = max(positions.values(), default=-1) + 1
+            for roi in created:
+                positions[roi['id']] = next_position
+                next_position += 1
+            remaining = {roi['id'] for roi in rois}
+            touched = {op['id'] for op in ops if op['op'] != 'create'} | {roi['id'] for roi in created}
+            conn.executemany("DELETE FROM rois WHERE id = ? AND project_id = ?",
+                             [(roi_id, project_id) for roi_id in positions if roi_id not in remaining])
+            conn.executemany(
+                "INSERT OR REPLACE INTO rois (id, project_id, position, data) VALUES (?, ?, ?, ?)",
+                [(roi['id'], project_id, positions[roi['id']], json.dumps(roi, ensure_ascii=False))
+                 for roi in rois if roi['id'] in touched])
+            self._touch(conn, project_id)
+            version = conn.execute("SELECT version FROM projects WHERE id = ?", (project_id,)).fetchone()[0]
+        self._changed(project_id)
+        return version, created
+
+    def delete(self, project_id):
+        import shutil
+        with self._write_lock, self._conn() as conn:
+            conn.execute("DELETE FROM projects WHERE id = ?", (project_id,))
+            self._published.discard(project_id)
+            self._pending.discard(project_id)
+        shutil.rmtree(os.path.join(self.projects_folder, project_id), ignore_errors=True)
+        for listener in self.change_listeners:
+            listener(project_id, None)
+
+    # config.json 同步輸出
+
+    def publish(self, project_id):
+        """輸出 config.json，之後的變更也會同步輸出"""
+        with self._write_lock:
+            self._published.add(project_id)
+            self._pending.add(project_id)
+        self.flush()
+
+    def add_change_listener(self, listener):
+        """註冊專案變更通知 (例如搜尋索引)"""
+        self.change_listeners.append(listener)
+
+    def _changed(self, project_id):
+        if self.change_listeners:
+            config = self.get(project_id)
+            for listener in self.change_listeners:
+                listener(project_id, config)
+        with self._write_lock:
+            if project_id not in self._published:
+                return
+            self._pending.add(project_id)
+            self._schedule_flush(self.write_delay)
+
+    def _schedule_flush(self, delay):
+        """delay 秒後輸出 (已排程時沿用原排程)"""
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._write_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending = list(self._pending)
+            self._pending.clear()
+
+            for project_id in pending:
+                config = self.get(project_id)
+                if config is None:
+                    continue
+                config_path = os.path.join(self.projects_folder, project_id, 'config.json')
+                try:
+                    ProjectRepository._write_atomic(config_path, json.dumps(config, ensure_ascii=False, indent=2))
+                except OSError as e:
+                    print(f"Error exporting project {project_id}: {e}")
+                    # 稍後重試，播放中的專案不會停留在舊的 config.json
+                    self._pending.add(project_id)
+                    self._schedule_flush(self.retry_delay)
@@ -5,8 +5,15 @@ class ROIEditor {
         this.canvas = document.getElementById('editorCanvas');
         this.ctx = this.canvas.getContext('2d');
         this.currentProject = null;
+        this.projectVersion = 0;
         this.backgroundImage = null;
         this.rois = [];
+        
+        // 待送出的 ROI 操作 (合併後批次送出)
+        this.pendingOps = [];
+        this.flushTimer = null;
+        this.flushing = null;
+        this.nextClientId = 1;
         this.selectedROI = null;
         this.currentTool = 'select';
         this.isDrawing = false;
@@ -77,8 +84,17 @@ class ROIEditor {
     
     async loadProjects() {
         try {
-            const response = await fetch('/api/projects');
-            const projects = await response.json();
+            // 只需名稱，依分頁取回所有專案摘要
+            const projects = [];
+            let cursor = null;
+            do {
+                const params = new URLSearchParams({fields: 'summary', limit: 200});
+                if (cursor) params.set('cursor', cursor);
+                const response = await fetch(`/api/projects?${params}`);
+                const page = await response.json();
+                projects.push(...page.projects);
+                cursor = page.next_cursor;
+            } while (cursor);
             
             const select = document.getElementById('projectSelect');
             select.innerHTML = '<option value="">選擇專案...</option>';
@@ -116,45 +132,163 @@ class ROIEditor {
     }
     
     async loadProject(projectId) {
+        if (this.currentProject) {
+            await this.flushOps();
+        }
+        
         this.currentProject = projectId;
         this.rois = [];
+        this.pendingOps = [];
         this.selectedROI = null;
+        this.backgroundImage = null;
+        
+        try {
+            const response = await fetch(`/api/projects/${projectId}`);
+            const project = await response.json();
+            this.projectVersion = project.version || 0;
+            this.rois = project.rois || [];
+            
+            // 畫布只需預覽版本，尚未產生時使用原圖
+            const variants = project.background_variants || {};
+            const background = (variants.preview && variants.preview.file) || project.background_image;
+            if (background) {
+                this.showBackground(`/projects/${projectId}/${background}`);
+            }
+        } catch (error) {
+            console.error('載入專案失敗:', error);
+        }
+        
         this.updateROIList();
         this.redraw();
     }
     
-    loadBackgroundImage(file) {
+    queueOp(op) {
+        // 合併同一 ROI 的操作：尚未送出的新增直接併入，刪除則抵銷
+        const pendingCreate = this.pendingOps.find(p => p.op === 'create' && p.client_id === op.id);
+        
+        if (op.op === 'update') {
+            if (pendingCreate) {
+                Object.assign(pendingCreate.roi, op.fields);
+                return this.scheduleFlush();
+            }
+            const pendingUpdate = this.pendingOps.find(p => p.op === 'update' && p.id === op.id);
+            if (pendingUpdate) {
+                Object.assign(pendingUpdate.fields, op.fields);
+                return this.scheduleFlush();
+            }
+        } else if (op.op === 'delete') {
+            this.pendingOps = this.pendingOps.filter(p => p.id !== op.id && p.client_id !== op.id);
+            if (pendingCreate) return this.scheduleFlush();
+        }
+        
+        this.pendingOps.push(op);
+        this.scheduleFlush();
+    }
+    
+    scheduleFlush() {
+        clearTimeout(this.flushTimer);
+        this.flushTimer = setTimeout(() => this.flushOps(), 300);
+    }
+    
+    async flushOps() {
+        clearTimeout(this.flushTimer);
+        if (this.flushing) await this.flushing;
+        if (this.pendingOps.length === 0 || !this.currentProject) return;
+        
+        const ops = this.pendingOps;
+        this.pendingOps = [];
+        this.flushing = this.sendOps(ops);
+        try {
+            await this.flushing;
+        } finally {
+            this.flushing = null;
+        }
+    }
+    
+    async sendOps(ops) {
+        try {
+            const response = await fetch(`/api/projects/${this.currentProject}/rois`, {
+                method: 'PATCH',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({version: this.projectVersion, ops: ops})
+            });
+            
+            if (response.status === 409) {
+                alert('專案已被其他視窗修改，將重新載入');
+                this.pendingOps = [];
+                const projectId = this.currentProject;
+                this.currentProject = null;
+                await this.loadProject(projectId);
+                return;
+            }
+            
+            const result = await response.json();
+            if (!response.ok) {
+                throw new Error(result.error);
+            }
+            
+            // 以正式 ID 取代暫時 ID
+            this.projectVersion = result.version;
+            result.created.forEach(saved => {
+                const clientId = saved.client_id;
+                delete saved.client_id;
+                const roi = this.rois.find(r => r.id === clientId);
+                if (roi) {
+                    Object.assign(roi, saved);
+                }
+                // 送出期間排入的操作也改用正式 ID
+                this.pendingOps.forEach(p => {
+                    if (p.id === clientId) p.id = saved.id;
+                });
+            });
+            this.updateROIList();
+        } catch (error) {
+            alert('儲存 ROI 失敗');
+            console.error(error);
+        }
+    }
+    
+    async loadBackgroundImage(file) {
         if (!this.currentProject) {
             alert('請先選擇專案');
             return;
         }
         
+        // 上傳會更新專案版本，先送出待處理的操作
+        await this.flushOps();
+        
         const formData = new FormData();
         formData.append('image', file);
         
-        fetch(`/api/projects/${this.currentProject}/upload`, {
-            method: 'POST',
-            body: formData
-        })
-        .then(response => response.json())
-        .then(data => {
+        try {
+            const response = await fetch(`/api/projects/${this.currentProject}/upload`, {
+                method: 'POST',
+                body: formData
+            });
+            
+            const data = await response.json();
             if (data.success) {
-                const img = new Image();
-                img.onload = () => {
-                    this.backgroundImage = img;
-                    this.redraw();
-                    
-                    // 顯示預覽
-                    const preview = document.getElementById('imagePreview');
-                    preview.innerHTML = `<img src="/projects/${this.currentProject}/${data.filename}" alt="背景圖片">`;
-                };
-                img.src = `/projects/${this.currentProject}/${data.filename}`;
+                this.projectVersion = data.version;
+                // 直接顯示本機檔案，不必重新下載原圖；縮小版本於背景產生
+                this.showBackground(URL.createObjectURL(file));
             }
-        })
-        .catch(error => {
+        } catch (error) {
             alert('上傳失敗');
             console.error(error);
-        });
+        }
+    }
+    
+    showBackground(url) {
+        const img = new Image();
+        img.onload = () => {
+            this.backgroundImage = img;
+            this.redraw();
+            
+            // 顯示預覽
+            const preview = document.getElementById('imagePreview');
+            preview.innerHTML = `<img src="${url}" alt="背景圖片">`;
+        };
+        img.src = url;
     }
     
     onMouseDown(e) {
@@ -232,27 +366,18 @@ class ROIEditor {
         this.addROI(roi);
     }
     
-    async addROI(roi) {
+    addROI(roi) {
         if (!this.currentProject) {
             alert('請先選擇專案');
             return;
         }
         
-        try {
-            const response = await fetch(`/api/projects/${this.currentProject}/rois`, {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(roi)
-            });
-            
-            const savedROI = await response.json();
-            this.rois.push(savedROI);
-            this.updateROIList();
-            this.redraw();
-        } catch (error) {
-            alert('新增 ROI 失敗');
-            console.error(error);
-        }
+        // 先在本地顯示，稍後批次送出
+        const clientId = `tmp-${this.nextClientId++}`;
+        this.rois.push(Object.assign({id: clientId}, roi));
+        this.queueOp({op: 'create', client_id: clientId, roi: Object.assign({}, roi)});
+        this.updateROIList();
+        this.redraw();
     }
     
     selectROI(x, y) {
@@ -350,7 +475,10 @@ class ROIEditor {
         if (!this.selectedROI) return;
         
         const newName = document.getElementById('roiName').value;
-        this.selectedROI.name = newName;
+        if (newName !== this.selectedROI.name) {
+            this.selectedROI.name = newName;
+            this.queueOp({op: 'update', id: this.selectedROI.id, fields: {name: newName}});
+        }
         
         // 處理音效上傳
         const audioFile = document.getElementById('audioUpload').files[0];
@@ -364,9 +492,13 @@ class ROIEditor {
     }
     
     async uploadAudio(file) {
+        // 音效需綁定正式 ROI ID，先送出待處理的操作
+        const roi = this.selectedROI;
+        await this.flushOps();
+        
         const formData = new FormData();
         formData.append('audio', file);
-        formData.append('roi_id', this.selectedROI.id);
+        formData.append('roi_id', roi.id);
         
         try {
             const response = await fetch(`/api/projects/${this.currentProject}/upload-audio`, {
@@ -376,7 +508,9 @@ class ROIEditor {
             
             const result = await response.json();
             if (result.success) {
-                this.selectedROI.audio_file = result.filename;
+                roi.audio_file = result.filename;
+                this.projectVersion = result.version;
+                this.updateROIList();
                 alert('音效上傳成功！');
             }
         } catch (error) {
@@ -388,6 +522,7 @@ class ROIEditor {
     deleteROI() {
         if (!this.selectedROI || !confirm('確定刪除此 ROI？')) return;
         
+        this.queueOp({op: 'delete', id: this.selectedROI.id});
         this.rois = this.rois.filter(roi => roi !== this.selectedROI);
         this.selectedROI = null;
         this.updateROIList();
@@ -401,6 +536,13 @@ class ROIEditor {
             return;
         }
         
+        // 匯出包含尚未送出的修改
+        await this.flushOps();
+        
+        const button = document.getElementById('exportBtn');
+        const label = button.textContent;
+        button.disabled = true;
+        
         try {
             const response = await fetch(`/api/projects/${this.currentProject}/export`, {
                 method: 'POST',
@@ -408,28 +550,41 @@ class ROIEditor {
                 body: JSON.stringify({width: 800, height: 600})
             });
             
-            const result = await response.json();
-            if (result.success) {
+            // 背景匯出，輪詢進度直到完成
+            let job = await response.json();
+            while (job.status === 'queued' || job.status === 'running') {
+                button.textContent = `匯出中 ${Math.round(job.progress * 100)}%`;
+                await new Promise(resolve => setTimeout(resolve, 500));
+                job = await (await fetch(`/api/export-jobs/${job.id}`)).json();
+            }
+            
+            if (job.status === 'done') {
                 // 自動下載
                 const link = document.createElement('a');
-                link.href = result.download_url;
-                link.download = result.filename;
+                link.href = job.download_url;
+                link.download = job.download_name;
                 link.click();
                 
                 alert('專案已匯出！');
+            } else {
+                alert(`匯出失敗: ${job.error}`);
             }
         } catch (error) {
             alert('匯出失敗');
             console.error(error);
+        } finally {
+            button.textContent = label;
+            button.disabled = false;
         }
     }
     
-    saveProject() {
+    async saveProject() {
         if (!this.currentProject) {
             alert('請先選擇專案');
             return;
         }
         
+        await this.flushOps();
         alert('專案已儲存！');
     }
 }
@@ -1,6 +1,7 @@
 // main.js - 支援深度檢測的前端邏輯
 
 let detectionInterval;
+let detectionStream = null;
 let isMonitoring = false;
 let lastDetectionData = {};
 
@@ -17,11 +18,44 @@ function startDetectionMonitoring() {
     if (isMonitoring) return;
     
     isMonitoring = true;
-    detectionInterval = setInterval(updateDetectionStatus, 500);
+    
+    // 優先使用伺服器推播，不支援時退回輪詢
+    if (window.EventSource) {
+        startDetectionStream();
+    } else {
+        startDetectionPolling();
+    }
     console.log('檢測監控已啟動');
 }
 
+function startDetectionStream() {
+    detectionStream = new EventSource('/api/detection-stream');
+    
+    detectionStream.addEventListener('detection', function(e) {
+        lastDetectionData = JSON.parse(e.data);
+        updateStatusDisplay(lastDetectionData);
+    });
+    
+    detectionStream.onerror = function() {
+        // 連線被關閉時改用輪詢
+        if (detectionStream.readyState === EventSource.CLOSED) {
+            detectionStream = null;
+            showErrorStatus();
+            startDetectionPolling();
+        }
+    };
+}
+
+function startDetectionPolling() {
+    if (detectionInterval) return;
+    detectionInterval = setInterval(updateDetectionStatus, 500);
+}
+
 function stopDetectionMonitoring() {
+    if (detectionStream) {
+        detectionStream.close();
+        detectionStream = null;
+    }
     if (detectionInterval) {
         clearInterval(detectionInterval);
         detectionInterval = null;
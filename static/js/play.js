@@ -1,16 +1,134 @@
 // 播放模式 JavaScript - 包含深度資訊顯示
 let detectionInterval;
+let detectionStream = null;
+let lastTouchSeq = null;  // 尚未取得目前序號時為 null
 let audioContext;
 
+// 瀏覽器播放模式 (?audio=browser)：音效在本機解碼與播放；伺服器是否同時播放由伺服器設定 (TOUCHHEAR_SERVER_AUDIO) 決定
+const audioMode = new URLSearchParams(window.location.search).get('audio') === 'browser' ? 'browser' : 'server';
+let masterGain = null;
+let audioClips = {};      // roi_id -> {clip, buffer}
+let activeSources = {};   // roi_id -> [AudioBufferSourceNode]
+let activeGroups = {};    // 互斥群組 -> roi_id
+let lastTriggered = {};
+let provisionalTouches = {};  // finger_id -> 預測觸碰已播放的 roi_id
+let failedClips = {};     // 清單中有但無法解碼的 roi_id
+let manifestLoading = null;
+let lastManifestLoad = 0;
+const DEDUP_WINDOW_MS = 80;
+const MANIFEST_RELOAD_MS = 5000;  // 觸碰到未載入的音效時，重新載入清單的最短間隔
+
 function initializePlayMode() {
     // 初始化音效上下文
     audioContext = new (window.AudioContext || window.webkitAudioContext)();
+    masterGain = audioContext.createGain();
+    masterGain.gain.value = document.getElementById('volume-slider').value / 100;
+    masterGain.connect(audioContext.destination);
+    
+    // 瀏覽器需要使用者操作後才允許出聲
+    const resume = () => audioContext.resume();
+    document.addEventListener('click', resume, {once: true});
+    document.addEventListener('touchstart', resume, {once: true});
+    
+    // 通知伺服器目前播放的專案，由檢測器解析 ROI 觸碰
+    activateProject();
     
     // 開始檢測監控
     startDetectionMonitoring();
 }
 
+function activateProject() {
+    const projectId = new URLSearchParams(window.location.search).get('project');
+    if (!projectId) return;
+    
+    fetch(`/api/projects/${projectId}/activate`, {method: 'POST'})
+        .catch(error => {
+            console.error('Error activating project:', error);
+        });
+    
+    if (audioMode === 'browser') {
+        reloadAudioManifest(projectId);
+    }
+}
+
+async function loadAudioManifest(projectId) {
+    // 載入時預先解碼所有音效，觸碰時直接播放
+    try {
+        const response = await fetch(`/api/projects/${projectId}/audio-manifest`);
+        const manifest = await response.json();
+        
+        const clips = {};
+        const failed = {};
+        await Promise.all(manifest.clips.map(async clip => {
+            // 音效檔名為內容雜湊，網址相同時沿用已解碼的音效
+            const previous = audioClips[clip.roi_id];
+            if (previous && previous.clip.url === clip.url) {
+                clips[clip.roi_id] = {clip: clip, buffer: previous.buffer};
+                return;
+            }
+            try {
+                const data = await (await fetch(clip.url)).arrayBuffer();
+                const buffer = await audioContext.decodeAudioData(data);
+                clips[clip.roi_id] = {clip: clip, buffer: buffer};
+            } catch (error) {
+                failed[clip.roi_id] = true;
+                console.error(`Error decoding audio ${clip.url}:`, error);
+            }
+        }));
+        audioClips = clips;
+        failedClips = failed;
+    } catch (error) {
+        console.error('Error loading audio manifest:', error);
+    }
+}
+
+function reloadAudioManifest(projectId) {
+    lastManifestLoad = performance.now();
+    manifestLoading = loadAudioManifest(projectId).finally(() => {
+        manifestLoading = null;
+    });
+}
+
+function requestManifestReload(roiId) {
+    // 專案音效有變動時重新載入清單；無法解碼的音效、載入中或剛載入過時不重複要求
+    const projectId = new URLSearchParams(window.location.search).get('project');
+    if (!projectId || failedClips[roiId] || manifestLoading) return;
+    if (performance.now() - lastManifestLoad < MANIFEST_RELOAD_MS) return;
+    reloadAudioManifest(projectId);
+}
+
 function startDetectionMonitoring() {
+    // 優先使用伺服器推播，不支援時退回輪詢
+    if (window.EventSource) {
+        startDetectionStream();
+    } else {
+        startDetectionPolling();
+    }
+}
+
+function startDetectionStream() {
+    detectionStream = new EventSource('/api/detection-stream');
+    
+    detectionStream.addEventListener('detection', function(e) {
+        const data = JSON.parse(e.data);
+        updatePlayStatus(data);
+        handleROITouches(data.roi_touches || []);
+    });
+    
+    detectionStream.addEventListener('touch', function(e) {
+        handleTouchEvent(JSON.parse(e.data));
+    });
+    
+    detectionStream.onerror = function() {
+        if (detectionStream.readyState === EventSource.CLOSED) {
+            detectionStream = null;
+            startDetectionPolling();
+        }
+    };
+}
+
+function startDetectionPolling() {
+    if (detectionInterval) return;
     detectionInterval = setInterval(updateDetectionAndAudio, 100); // 更頻繁的檢測
 }
 
@@ -19,13 +137,119 @@ function updateDetectionAndAudio() {
         .then(response => response.json())
         .then(data => {
             updatePlayStatus(data);
-            handleROITouches(data.roi_touches);
+            handleROITouches(data.roi_touches || []);
+            
+            // 第一次輪詢只記錄目前序號，不播放頁面開啟前的舊事件
+            if (lastTouchSeq === null) {
+                lastTouchSeq = data.touch_seq || 0;
+                return;
+            }
+            
+            // 有新的觸碰事件時才取回
+            if (data.touch_seq > lastTouchSeq) {
+                fetchTouchEvents();
+            }
         })
         .catch(error => {
             console.error('Error fetching detection status:', error);
         });
 }
 
+function fetchTouchEvents() {
+    fetch(`/api/touch-events?since=${lastTouchSeq}`)
+        .then(response => response.json())
+        .then(events => {
+            events.forEach(handleTouchEvent);
+        })
+        .catch(error => {
+            console.error('Error fetching touch events:', error);
+        });
+}
+
+function handleTouchEvent(event) {
+    if (event.seq <= lastTouchSeq) return;
+    lastTouchSeq = event.seq;
+    
+    // 伺服器模式下音效已在檢測當下播放
+    if (audioMode !== 'browser') return;
+    
+    if (event.type === 'touch_confirm' || event.type === 'touch_cancel') {
+        // 只有預測的 touch_down 確實在同一個 ROI 播放過，touch_confirm 才不重複觸發
+        const roiId = provisionalTouches[event.finger_id];
+        delete provisionalTouches[event.finger_id];
+        if (event.type === 'touch_confirm' && event.roi && event.roi.id === roiId) return;
+        // 預測觸碰未成立或落在其他 ROI，停止已播放的聲音
+        if (roiId) {
+            stopLocalAudio(roiId);
+            delete lastTriggered[roiId];
+        }
+        if (event.type === 'touch_cancel') return;
+    } else if (event.type !== 'touch_down') {
+        return;
+    }
+    
+    if (event.roi && event.roi.audio_file) {
+        if (playLocalAudio(event.roi.id) && event.type === 'touch_down' && event.provisional) {
+            provisionalTouches[event.finger_id] = event.roi.id;
+        }
+    }
+}
+
+function playLocalAudio(roiId) {
+    const entry = audioClips[roiId];
+    if (!entry) {
+        requestManifestReload(roiId);
+        return false;
+    }
+    
+    const clip = entry.clip;
+    const now = performance.now();
+    const cooldownMs = Math.max(DEDUP_WINDOW_MS, (clip.cooldown || 0) * 1000);
+    if (now - (lastTriggered[roiId] || 0) < cooldownMs) return false;
+    
+    const playing = activeSources[roiId] || [];
+    if (playing.length > 0) {
+        if (clip.retrigger === 'ignore') return false;
+        if (clip.retrigger === 'restart') stopLocalAudio(roiId);
+    }
+    
+    // 同一群組同時只播放一個聲音
+    if (clip.group && activeGroups[clip.group] && activeGroups[clip.group] !== roiId) {
+        stopLocalAudio(activeGroups[clip.group]);
+    }
+    
+    const source = audioContext.createBufferSource();
+    source.buffer = entry.buffer;
+    // 個別音量再乘上主音量
+    const gain = audioContext.createGain();
+    gain.gain.value = clip.volume === undefined ? 1 : clip.volume;
+    source.connect(gain).connect(masterGain);
+    source.onended = () => {
+        const sources = activeSources[roiId] || [];
+        const index = sources.indexOf(source);
+        if (index < 0) return;
+        sources.splice(index, 1);
+        if (sources.length === 0 && activeGroups[clip.group] === roiId) {
+            delete activeGroups[clip.group];
+        }
+    };
+    source.start();
+    // 只記錄實際播放的觸發，未播放的預測不會擋下隨後的 touch_confirm
+    lastTriggered[roiId] = now;
+    
+    activeSources[roiId] = (activeSources[roiId] || []).concat([source]);
+    if (clip.group) activeGroups[clip.group] = roiId;
+    return true;
+}
+
+function stopLocalAudio(roiId) {
+    (activeSources[roiId] || []).forEach(source => {
+        source.onended = null;
+        source.stop();
+    });
+    delete activeSources[roiId];
+}
+
 function updatePlayStatus(data) {
     const boardStatus = document.getElementById('board-status');
     const handStatus = document.getElementById('hand-status');
@@ -115,11 +339,6 @@ function handleROITouches(touchedROIs) {
             ${roi.audio_file ? '<i class="fas fa-volume-up text-success"></i>' : '<i class="fas fa-volume-mute text-muted"></i>'}
         `;
         touchList.appendChild(div);
-        
-        // 播放對應音效
-        if (roi.audio_file) {
-            playROIAudio(roi.id, roi.audio_file);
-        }
     });
     
     if (touchedROIs.length === 0) {
@@ -127,14 +346,12 @@ function handleROITouches(touchedROIs) {
     }
 }
 
-function playROIAudio(roiId, audioFile) {
+function playROIAudio(roiId) {
+    // 手動觸發 (測試用)
     fetch('/api/play-audio', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({
-            roi_id: roiId,
-            audio_file: audioFile
-        })
+        body: JSON.stringify({roi_id: roiId})
     })
     .catch(error => {
         console.error('Error playing audio:', error);
@@ -144,6 +361,11 @@ function playROIAudio(roiId, audioFile) {
 function setVolume(volume) {
     document.getElementById('volume-display').textContent = volume;
     
+    if (audioMode === 'browser') {
+        masterGain.gain.value = volume / 100;
+        return;
+    }
+    
     fetch('/api/set-volume', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
@@ -152,6 +374,12 @@ function setVolume(volume) {
 }
 
 function stopAllAudio() {
+    if (audioMode === 'browser') {
+        Object.keys(activeSources).forEach(stopLocalAudio);
+        activeGroups = {};
+        return;
+    }
+    
     fetch('/api/stop-audio', {method: 'POST'});
 }
 
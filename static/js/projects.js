@@ -3,6 +3,8 @@
 class ProjectManager {
     constructor() {
         this.projects = [];
+        this.nextCursor = null;
+        this.pageSize = 24;
         this.init();
     }
     
@@ -17,10 +19,16 @@ class ProjectManager {
         });
     }
     
-    async loadProjects() {
+    async loadProjects(cursor = null) {
+        // 只取列表需要的摘要欄位，分頁載入
+        const params = new URLSearchParams({fields: 'summary', sort: 'created', limit: this.pageSize});
+        if (cursor) params.set('cursor', cursor);
+        
         try {
-            const response = await fetch('/api/projects');
-            this.projects = await response.json();
+            const response = await fetch(`/api/projects?${params}`);
+            const page = await response.json();
+            this.projects = cursor ? this.projects.concat(page.projects) : page.projects;
+            this.nextCursor = page.next_cursor;
             this.renderProjects();
         } catch (error) {
             console.error('載入專案失敗:', error);
@@ -28,6 +36,12 @@ class ProjectManager {
         }
     }
     
+    loadMoreProjects() {
+        if (this.nextCursor) {
+            this.loadProjects(this.nextCursor);
+        }
+    }
+    
     renderProjects() {
         const grid = document.getElementById('projectsGrid');
         const emptyState = document.getElementById('emptyState');
@@ -46,14 +60,24 @@ class ProjectManager {
             const card = this.createProjectCard(project);
             grid.appendChild(card);
         });
+        
+        if (this.nextCursor) {
+            const more = document.createElement('button');
+            more.className = 'btn btn-secondary';
+            more.textContent = '載入更多';
+            more.onclick = () => this.loadMoreProjects();
+            grid.appendChild(more);
+        }
     }
     
     createProjectCard(project) {
         const card = document.createElement('div');
         card.className = 'project-card';
         
-        const previewImg = project.background_image 
-            ? `<img src="/projects/${project.id}/${project.background_image}" alt="預覽">`
+        // 使用縮圖，尚未產生時使用原圖
+        const previewFile = project.thumbnail || project.background_image;
+        const previewImg = previewFile 
+            ? `<img src="/projects/${project.id}/${previewFile}" alt="預覽" loading="lazy">`
             : '<div class="no-preview">無圖片</div>';
         
         card.innerHTML = `
@@ -63,7 +87,7 @@ class ProjectManager {
             <div class="project-info">
                 <h4>${project.name}</h4>
                 <p>建立時間: ${new Date(project.created_at).toLocaleDateString()}</p>
-                <p>ROI 數量: ${project.rois.length}</p>
+                <p>ROI 數量: ${project.roi_count}</p>
             </div>
             <div class="project-actions">
                 <button class="btn btn-primary" onclick="projectManager.editProject('${project.id}')">
@@ -95,7 +119,8 @@ class ProjectManager {
             const project = await response.json();
             
             if (project.id) {
-                this.projects.push(project);
+                project.roi_count = project.rois.length;
+                this.projects.unshift(project);
                 this.renderProjects();
                 window.showNotification('專案建立成功！', 'success');
                 
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import cv2
 import numpy as np
 
@@ -16,31 +18,113 @@ def generate_aruco_markers():
         cv2.imwrite(filename, bordered_img)
         print(f'生成: {filename}')
 
-def create_a4_template_with_rois(image_path=None, rois=None, output_path='a4_template.png'):
-    """創建包含圖片、ROI 和 ArUco 的 A4 模板"""
+# A4 尺寸 (300 DPI) 與版面配置
+A4_WIDTH, A4_HEIGHT = 2480, 3508
+MARKER_SIZE = 150  # 稍微小一點的標記
+MARKER_MARGIN = 30
+
+# ArUco 標記位置（四角）
+MARKER_POSITIONS = [
+    (MARKER_MARGIN, MARKER_MARGIN),                                                    # 左上
+    (A4_WIDTH - MARKER_SIZE - MARKER_MARGIN, MARKER_MARGIN),                           # 右上
+    (A4_WIDTH - MARKER_SIZE - MARKER_MARGIN, A4_HEIGHT - MARKER_SIZE - MARKER_MARGIN), # 右下
+    (MARKER_MARGIN, A4_HEIGHT - MARKER_SIZE - MARKER_MARGIN)                           # 左下
+]
+
+# 內容區域
+CONTENT_LEFT = MARKER_POSITIONS[0][0] + MARKER_SIZE + 50
+CONTENT_RIGHT = MARKER_POSITIONS[1][0] - 50
+CONTENT_TOP = MARKER_POSITIONS[0][1] + MARKER_SIZE + 50
+CONTENT_BOTTOM = MARKER_POSITIONS[3][1] - 50
+CONTENT_WIDTH = CONTENT_RIGHT - CONTENT_LEFT
+CONTENT_HEIGHT = CONTENT_BOTTOM - CONTENT_TOP
+
+ROI_COLOR = (0, 255, 0)
+ROI_OPACITY = 0.2
+
+INSTRUCTIONS = [
+    "1. Print this template at actual size (A4)",
+    "2. Place flat in front of camera",
+    "3. Touch green ROI areas to trigger audio"
+]
+
+
+@lru_cache(maxsize=None)
+def aruco_marker(marker_id, size=MARKER_SIZE):
+    """ArUco 標記圖 (BGR)，產生一次後重複使用"""
     aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
-    marker_size = 150  # 稍微小一點的標記
+    marker = cv2.aruco.generateImageMarker(aruco_dict, marker_id, size)
+    marker_bgr = cv2.cvtColor(marker, cv2.COLOR_GRAY2BGR)
+    marker_bgr.flags.writeable = False
+    return marker_bgr
+
+
+@lru_cache(maxsize=1)
+def static_layout():
+    """不隨專案改變的版面：標記、標記 ID、標題與說明 (唯讀，使用時需複製)"""
+    layout = np.full((A4_HEIGHT, A4_WIDTH, 3), 255, dtype=np.uint8)
+    
+    # 放置 ArUco 標記
+    for i, (x, y) in enumerate(MARKER_POSITIONS):
+        layout[y:y+MARKER_SIZE, x:x+MARKER_SIZE] = aruco_marker(i)
+        
+        # 標記 ID 標籤
+        cv2.putText(layout, f'ID:{i}', (x, y-10), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0,0,0), 3)
+    
+    # 添加標題和說明
+    title = "TouchHear Interactive Template"
+    cv2.putText(layout, title, (A4_WIDTH//2 - 300, 80), 
+               cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0,0,0), 3)
     
-    # A4 尺寸 (300 DPI)
-    a4_width, a4_height = 2480, 3508
-    layout = np.ones((a4_height, a4_width, 3), dtype=np.uint8) * 255
+    for i, instruction in enumerate(INSTRUCTIONS):
+        cv2.putText(layout, instruction, (CONTENT_LEFT, A4_HEIGHT - 150 + i*30), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,0), 2)
+    
+    layout.flags.writeable = False
+    return layout
+
+
+def composite_fills(layout, rects, color=ROI_COLOR, opacity=ROI_OPACITY):
+    """一次合成所有半透明填色
     
-    # ArUco 標記位置（四角）
-    margin = 30
-    positions = [
-        (margin, margin),                                    # 左上
-        (a4_width-marker_size-margin, margin),              # 右上
-        (a4_width-marker_size-margin, a4_height-marker_size-margin), # 右下
-        (margin, a4_height-marker_size-margin)              # 左下
-    ]
+    依序疊加 n 層不透明度 opacity 的填色等同於 alpha = 1 - (1 - opacity)^n，
+    因此只需累計每個像素被幾個 ROI 覆蓋，最後在 ROI 範圍內混合一次。
+    rects: [(x1, y1, x2, y2)]，含端點 (與 cv2.rectangle 相同)
+    """
+    height, width = layout.shape[:2]
+    clipped = []
+    for x1, y1, x2, y2 in rects:
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2 + 1, width), min(y2 + 1, height)
+        if x1 < x2 and y1 < y2:
+            clipped.append((x1, y1, x2, y2))
+    if not clipped:
+        return layout
     
-    # 計算內容區域
-    content_left = positions[0][0] + marker_size + 50
-    content_right = positions[1][0] - 50
-    content_top = positions[0][1] + marker_size + 50
-    content_bottom = positions[3][1] - 50
-    content_width = content_right - content_left
-    content_height = content_bottom - content_top
+    # 覆蓋次數只在所有 ROI 的外框範圍內累計
+    bx1 = min(r[0] for r in clipped)
+    by1 = min(r[1] for r in clipped)
+    bx2 = max(r[2] for r in clipped)
+    by2 = max(r[3] for r in clipped)
+    coverage = np.zeros((by2 - by1, bx2 - bx1), dtype=np.uint8 if len(clipped) < 256 else np.uint16)
+    for x1, y1, x2, y2 in clipped:
+        coverage[y1-by1:y2-by1, x1-bx1:x2-bx1] += 1
+    if coverage.dtype != np.uint8:
+        coverage = np.minimum(coverage, 255).astype(np.uint8)
+    
+    # 覆蓋次數查表得到權重，未覆蓋的像素權重為 1，混合後不變
+    keep = ((1 - opacity) ** np.arange(256)).astype(np.float32)
+    region = layout[by1:by2, bx1:bx2]
+    fill = np.empty_like(region)
+    fill[:] = color
+    region[:] = cv2.blendLinear(region, fill, cv2.LUT(coverage, keep), cv2.LUT(coverage, 1 - keep))
+    return layout
+
+
+def create_a4_template_with_rois(image_path=None, rois=None, output_path='a4_template.png'):
+    """創建包含圖片、ROI 和 ArUco 的 A4 模板"""
+    layout = static_layout().copy()
     
     # 載入並縮放背景圖片
     if image_path:
@@ -50,8 +134,8 @@ def create_a4_template_with_rois(image_path=None, rois=None, output_path='a4_tem
                 h, w = image.shape[:2]
                 
                 # 計算縮放比例（保持長寬比）
-                scale_w = content_width / w
-                scale_h = content_height / h
+                scale_w = CONTENT_WIDTH / w
+                scale_h = CONTENT_HEIGHT / h
                 scale = min(scale_w, scale_h)
                 
                 # 縮放圖片
@@ -59,75 +143,53 @@ def create_a4_template_with_rois(image_path=None, rois=None, output_path='a4_tem
                 resized_img = cv2.resize(image, (new_w, new_h))
                 
                 # 置中放置
-                start_x = content_left + (content_width - new_w) // 2
-                start_y = content_top + (content_height - new_h) // 2
+                start_x = CONTENT_LEFT + (CONTENT_WIDTH - new_w) // 2
+                start_y = CONTENT_TOP + (CONTENT_HEIGHT - new_h) // 2
                 
                 layout[start_y:start_y+new_h, start_x:start_x+new_w] = resized_img
                 print(f'背景圖片已放置: {new_w}x{new_h} pixels')
         except Exception as e:
             print(f'處理圖片錯誤: {e}')
     
-    # 繪製 ROI 區域
-    if rois:
-        for roi in rois:
-            # 將 ROI 座標映射到 A4 模板
-            roi_x = content_left + int(roi['x'] * content_width / 800)  # 假設編輯器是 800px 寬
-            roi_y = content_top + int(roi['y'] * content_height / 600)  # 假設編輯器是 600px 高
-            roi_w = int(roi['width'] * content_width / 800)
-            roi_h = int(roi['height'] * content_height / 600)
-            
-            # 繪製 ROI 矩形（半透明）
-            overlay = layout.copy()
-            cv2.rectangle(overlay, (roi_x, roi_y), (roi_x + roi_w, roi_y + roi_h), 
-                         (0, 255, 0), -1)
-            layout = cv2.addWeighted(layout, 0.8, overlay, 0.2, 0)
-            
-            # 繪製邊框
-            cv2.rectangle(layout, (roi_x, roi_y), (roi_x + roi_w, roi_y + roi_h), 
-                         (0, 255, 0), 3)
-            
-            # 添加 ROI 標籤
-            label = roi.get('name', f"ROI {roi['id']}")
-            audio_icon = " 🔊" if roi.get('audio_file') else ""
-            full_label = label + audio_icon
-            
-            # 標籤背景
-            label_size = cv2.getTextSize(full_label, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)[0]
-            cv2.rectangle(layout, (roi_x, roi_y - 30), 
-                         (roi_x + label_size[0] + 10, roi_y), (255, 255, 255), -1)
-            cv2.rectangle(layout, (roi_x, roi_y - 30), 
-                         (roi_x + label_size[0] + 10, roi_y), (0, 255, 0), 2)
-            
-            # 標籤文字
-            cv2.putText(layout, full_label, (roi_x + 5, roi_y - 8), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+    # 將 ROI 座標映射到 A4 模板 (假設編輯器是 800x600 px)
+    rects = []
+    for roi in rois or []:
+        roi_x = CONTENT_LEFT + int(roi['x'] * CONTENT_WIDTH / 800)
+        roi_y = CONTENT_TOP + int(roi['y'] * CONTENT_HEIGHT / 600)
+        roi_w = int(roi['width'] * CONTENT_WIDTH / 800)
+        roi_h = int(roi['height'] * CONTENT_HEIGHT / 600)
+        rects.append((roi_x, roi_y, roi_x + roi_w, roi_y + roi_h))
     
-    # 放置 ArUco 標記
-    for i, (x, y) in enumerate(positions):
-        marker = cv2.aruco.generateImageMarker(aruco_dict, i, marker_size)
-        marker_bgr = cv2.cvtColor(marker, cv2.COLOR_GRAY2BGR)
-        layout[y:y+marker_size, x:x+marker_size] = marker_bgr
-        
-        # 標記 ID 標籤
-        cv2.putText(layout, f'ID:{i}', (x, y-10), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0,0,0), 3)
+    # 繪製 ROI 矩形（半透明，一次合成）
+    composite_fills(layout, rects)
     
-    # 添加標題和說明
-    title = "TouchHear Interactive Template"
-    cv2.putText(layout, title, (a4_width//2 - 300, 80), 
-               cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0,0,0), 3)
+    # 繪製邊框與標籤
+    for roi, (x1, y1, x2, y2) in zip(rois or [], rects):
+        cv2.rectangle(layout, (x1, y1), (x2, y2), ROI_COLOR, 3)
+        
+        # 添加 ROI 標籤
+        label = roi.get('name', f"ROI {roi['id']}")
+        audio_icon = " 🔊" if roi.get('audio_file') else ""
+        full_label = label + audio_icon
+        
+        # 標籤背景
+        label_size = cv2.getTextSize(full_label, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)[0]
+        cv2.rectangle(layout, (x1, y1 - 30), 
+                     (x1 + label_size[0] + 10, y1), (255, 255, 255), -1)
+        cv2.rectangle(layout, (x1, y1 - 30), 
+                     (x1 + label_size[0] + 10, y1), ROI_COLOR, 2)
+        
+        # 標籤文字
+        cv2.putText(layout, full_label, (x1 + 5, y1 - 8), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
     
-    # 說明文字
-    instructions = [
-        "1. Print this template at actual size (A4)",
-        "2. Place flat in front of camera",
-        "3. Touch green ROI areas to trigger audio",
-        f"Generated ROIs: {len(rois) if rois else 0}"
-    ]
+    # 標記需保持完整以供偵測，蓋回 ROI 可能超出內容區域的部分
+    for i, (x, y) in enumerate(MARKER_POSITIONS):
+        layout[y:y+MARKER_SIZE, x:x+MARKER_SIZE] = aruco_marker(i)
     
-    for i, instruction in enumerate(instructions):
-        cv2.putText(layout, instruction, (content_left, a4_height - 150 + i*30), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,0), 2)
+    cv2.putText(layout, f"Generated ROIs: {len(rois) if rois else 0}", 
+               (CONTENT_LEFT, A4_HEIGHT - 150 + len(INSTRUCTIONS)*30), 
+               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,0), 2)
     
     # 儲存
     cv2.imwrite(output_path, layout)
@@ -125,7 +125,11 @@ class FixedROIDetector(QWidget):
         self.background_scale_info = None  # 背景縮放資訊
         
     def setup_audio(self):
+        # 小緩衝區 + 多聲道，觸發時直接播放已解碼的音效
+        pygame.mixer.pre_init(44100, -16, 2, 256)
         pygame.mixer.init()
+        pygame.mixer.set_num_channels(8)
+        self.sound_cache = {}
         self.audio_cooldowns = {}
         self.volume = 0.7
         
@@ -145,6 +149,7 @@ class FixedROIDetector(QWidget):
                 self.project_data = json.load(f)
                 
             self.calculate_background_scale()
+            self.preload_sounds()
             self.update_roi_list()
             
             roi_count = len(self.project_data.get('rois', []))
@@ -370,11 +375,25 @@ class FixedROIDetector(QWidget):
                             
         return touched_rois
     
+    def preload_sounds(self):
+        """載入專案時預先解碼所有 ROI 音效"""
+        self.sound_cache = {}
+        for roi in self.project_data.get('rois', []):
+            audio_file = roi.get('audio_file', '')
+            if audio_file and os.path.exists(audio_file) and audio_file not in self.sound_cache:
+                try:
+                    self.sound_cache[audio_file] = pygame.mixer.Sound(audio_file)
+                except Exception as e:
+                    print(f"Audio load error: {e}")
+    
     def play_audio(self, audio_file):
+        sound = self.sound_cache.get(audio_file)
+        if sound is None:
+            return
         try:
-            pygame.mixer.music.load(audio_file)
-            pygame.mixer.music.set_volume(self.volume)
-            pygame.mixer.music.play()
+            channel = pygame.mixer.find_channel(True)
+            channel.set_volume(self.volume)
+            channel.play(sound)
         except Exception as e:
             print(f"Audio playback error: {e}")
             
@@ -382,7 +401,7 @@ class FixedROIDetector(QWidget):
         self.volume = value / 100.0
         
     def stop_audio(self):
-        pygame.mixer.music.stop()
+        pygame.mixer.stop()
         
     def update_frame(self):
         try:
@@ -131,12 +131,35 @@ class ROICanvas(QLabel):
         self.rois = rois
         self.update()
 
+# Renders the A4 template off the GUI thread
+class TemplateExportThread(QThread):
+    exported = pyqtSignal(str)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, image_path, rois, output_path):
+        super().__init__()
+        self.image_path = image_path
+        self.rois = json.loads(json.dumps(rois))  # snapshot: edits during export don't affect it
+        self.output_path = output_path
+        
+    def run(self):
+        try:
+            create_a4_template_with_rois(
+                image_path=self.image_path,
+                rois=self.rois,
+                output_path=self.output_path
+            )
+            self.exported.emit(self.output_path)
+        except Exception as e:
+            self.failed.emit(str(e))
+
 class ROIEditor(QMainWindow):
     def __init__(self):
         super().__init__()
         self.project_file = None
         self.background_image_path = None
         self.project_modified = False
+        self.export_thread = None
         self.setup_ui()
         self.setup_audio()
         self.create_default_folders()
@@ -270,10 +293,10 @@ class ROIEditor(QMainWindow):
         export_group = QGroupBox("Export")
         export_layout = QVBoxLayout()
         
-        export_btn = QPushButton("📄 Generate A4 Template")
-        export_btn.clicked.connect(self.export_a4_template)
-        export_btn.setStyleSheet("QPushButton { background-color: #4CAF50; color: white; font-weight: bold; }")
-        export_layout.addWidget(export_btn)
+        self.export_btn = QPushButton("📄 Generate A4 Template")
+        self.export_btn.clicked.connect(self.export_a4_template)
+        self.export_btn.setStyleSheet("QPushButton { background-color: #4CAF50; color: white; font-weight: bold; }")
+        export_layout.addWidget(self.export_btn)
         
         export_group.setLayout(export_layout)
         layout.addWidget(export_group)
@@ -544,6 +567,8 @@ class ROIEditor(QMainWindow):
             QMessageBox.critical(self, "Load Error", f"Failed to load project:\n{e}")
             
     def export_a4_template(self):
+        if self.export_thread is not None:
+            return
         if not self.canvas.rois:
             QMessageBox.warning(self, "Warning", "No ROIs to export! Please create some ROIs first.")
             return
@@ -558,43 +583,54 @@ class ROIEditor(QMainWindow):
             self, "Export A4 Template", default_name, "PNG (*.png)")
         
         if file_path:
+            # Render in a worker thread so the editor stays responsive
+            self.export_thread = TemplateExportThread(
+                self.background_image_path, self.canvas.get_rois(), file_path)
+            self.export_thread.exported.connect(self.on_template_exported)
+            self.export_thread.failed.connect(self.on_template_export_failed)
+            self.export_thread.finished.connect(self.on_template_export_finished)
+            self.export_btn.setEnabled(False)
+            self.export_btn.setText("⏳ Exporting...")
+            self.export_thread.start()
+            
+    def on_template_export_finished(self):
+        self.export_thread.deleteLater()
+        self.export_thread = None
+        self.export_btn.setEnabled(True)
+        self.export_btn.setText("📄 Generate A4 Template")
+        
+    def on_template_export_failed(self, error):
+        QMessageBox.critical(self, "Export Error", f"Failed to export template:\n{error}")
+        
+    def on_template_exported(self, file_path):
+        rois = self.export_thread.rois
+        rel_path = os.path.relpath(file_path)
+        roi_count = len(rois)
+        audio_count = sum(1 for roi in rois if roi.get('audio_file'))
+        
+        QMessageBox.information(self, "Template Exported", 
+            f"🎯 A4 template exported successfully!\n\n"
+            f"📁 File: {rel_path}\n"
+            f"📋 ROIs: {roi_count}\n"
+            f"🔊 With audio: {audio_count}\n\n"
+            f"📄 Print this template at actual size (A4)\n"
+            f"🎯 Use with TouchHear detector for interaction!")
+        
+        reply = QMessageBox.question(self, "Open Template", 
+            "Open the exported template?", 
+            QMessageBox.Yes | QMessageBox.No)
+        if reply == QMessageBox.Yes:
             try:
-                create_a4_template_with_rois(
-                    image_path=self.background_image_path,
-                    rois=self.canvas.get_rois(),
-                    output_path=file_path
-                )
-                
-                rel_path = os.path.relpath(file_path)
-                roi_count = len(self.canvas.rois)
-                audio_count = sum(1 for roi in self.canvas.rois if roi.get('audio_file'))
-                
-                QMessageBox.information(self, "Template Exported", 
-                    f"🎯 A4 template exported successfully!\n\n"
-                    f"📁 File: {rel_path}\n"
-                    f"📋 ROIs: {roi_count}\n"
-                    f"🔊 With audio: {audio_count}\n\n"
-                    f"📄 Print this template at actual size (A4)\n"
-                    f"🎯 Use with TouchHear detector for interaction!")
-                
-                reply = QMessageBox.question(self, "Open Template", 
-                    "Open the exported template?", 
-                    QMessageBox.Yes | QMessageBox.No)
-                if reply == QMessageBox.Yes:
+                os.startfile(file_path)
+            except:
+                import subprocess
+                try:
+                    subprocess.run(['xdg-open', file_path])
+                except:
                     try:
-                        os.startfile(file_path)
+                        subprocess.run(['open', file_path])
                     except:
-                        import subprocess
-                        try:
-                            subprocess.run(['xdg-open', file_path])
-                        except:
-                            try:
-                                subprocess.run(['open', file_path])
-                            except:
-                                pass
-                    
-            except Exception as e:
-                QMessageBox.critical(self, "Export Error", f"Failed to export template:\n{e}")
+                        pass
                 
     def closeEvent(self, event):
         if self.project_modified:
@@ -0,0 +1,235 @@
+# touch_tracker.py - 指尖觸碰狀態機模組
+import itertools
+import threading
+from collections import deque
+
+
+class FingerTrack:
+    """單一指尖的追蹤狀態"""
+
+    def __init__(self, finger_id, position, a4_coord, history_size=5):
+        self.finger_id = finger_id
+        self.position = position
+        self.a4_coord = a4_coord
+        self.touching = False
+        self.enter_count = 0
+        self.exit_count = 0
+        self.missed_frames = 0
+        self.roi = None
+        self.predictive = False
+        self.provisional = False
+        self.provisional_at = 0
+        self.depth_history = deque(maxlen=history_size)  # (時間, 深度差)
+
+
+class TouchTracker:
+    """指尖觸碰狀態機：遲滯閾值、防彈跳與跨幀身分追蹤
+
+    每幀輸入指尖列表，輸出 touch_down / touch_move / touch_up 事件。
+    指尖資料可帶 depth_diff (深度差，mm) 或 is_touching (布林)，
+    depth_diff 為 None 時維持上一幀狀態。更新後會在每筆指尖資料寫回
+    finger_id 與 touching (防彈跳後的接觸狀態)。
+
+    ROI 設定 predictive 時，依深度差歷史估計接近速度，預測下一幀會接觸
+    就先發出 provisional 的 touch_down，之後以 touch_confirm 或
+    touch_cancel 確認或取消。
+    """
+
+    def __init__(self, enter_threshold=30, exit_threshold=45, min_down_frames=2, min_up_frames=2,
+                 max_match_distance=80, max_missed_frames=3, max_events=256,
+                 min_approach_velocity=50, prediction_timeout=0.15, history_size=5):
+        self.enter_threshold = enter_threshold   # 深度差小於此值才開始計入接觸
+        self.exit_threshold = exit_threshold     # 深度差大於此值才開始計入離開
+        self.min_down_frames = min_down_frames
+        self.min_up_frames = min_up_frames
+        self.max_match_distance = max_match_distance  # 跨幀配對的最大像素距離
+        self.max_missed_frames = max_missed_frames
+        self.min_approach_velocity = min_approach_velocity  # mm/s，低於此速度不預測
+        self.prediction_timeout = prediction_timeout        # 預測後未確認即取消 (秒)
+        self.history_size = history_size
+
+        self.tracks = {}
+        self.events = deque(maxlen=max_events)
+        self.last_seq = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _match(self, fingers):
+        """以最近距離將本幀指尖配對到既有軌跡"""
+        pairs = []
+        for track_id, track in self.tracks.items():
+            for i, finger in enumerate(fingers):
+                dx = finger['position'][0] - track.position[0]
+                dy = finger['position'][1] - track.position[1]
+                dist = (dx * dx + dy * dy) ** 0.5
+                if dist <= self.max_match_distance:
+                    pairs.append((dist, track_id, i))
+
+        matches = {}
+        used_tracks = set()
+        for dist, track_id, i in sorted(pairs):
+            if track_id in used_tracks or i in matches:
+                continue
+            used_tracks.add(track_id)
+            matches[i] = track_id
+        return matches
+
+    def _contact_signal(self, finger):
+        """回傳 (是否達到接觸條件, 是否達到離開條件)，無資料時回傳 None"""
+        depth_diff = finger.get('depth_diff')
+        if depth_diff is not None:
+            return depth_diff < self.enter_threshold, depth_diff > self.exit_threshold
+
+        is_touching = finger.get('is_touching')
+        if is_touching is not None:
+            return is_touching, not is_touching
+
+        return None
+
+    def _approach_velocity(self, track):
+        """以最小平方法估計深度差變化速度 (mm/s，負值表示接近紙面)"""
+        history = track.depth_history
+        if len(history) < 3:
+            return None
+
+        t0 = history[0][0]
+        times = [t - t0 for t, _ in history]
+        depths = [d for _, d in history]
+        mean_t = sum(times) / len(times)
+        mean_d = sum(depths) / len(depths)
+
+        variance = sum((t - mean_t) ** 2 for t in times)
+        if variance == 0:
+            return None
+        return sum((t - mean_t) * (d - mean_d) for t, d in zip(times, depths)) / variance
+
+    def _predict_contact(self, track):
+        """預測下一幀是否會進入接觸閾值"""
+        velocity = self._approach_velocity(track)
+        if velocity is None or velocity > -self.min_approach_velocity:
+            return False
+
+        history = track.depth_history
+        frame_interval = (history[-1][0] - history[0][0]) / (len(history) - 1)
+        predicted_depth = history[-1][1] + velocity * frame_interval
+        return predicted_depth < self.enter_threshold
+
+    def _emit(self, event_type, track, now, **extra):
+        self.last_seq += 1
+        event = {
+            "seq": self.last_seq,
+            "type": event_type,
+            "finger_id": track.finger_id,
+            "timestamp": now,
+            "position": [int(track.position[0]), int(track.position[1])],
+            "a4_coord": [float(track.a4_coord[0]), float(track.a4_coord[1])] if track.a4_coord else None,
+            "roi": track.roi
+        }
+        event.update(extra)
+        self.events.append(event)
+        return event
+
+    def _step(self, track, finger, moved, now):
+        """依本幀接觸訊號推進單一指尖的狀態機"""
+        signal = self._contact_signal(finger)
+        if signal is None:
+            return []
+        pressed, released = signal
+
+        if finger.get('depth_diff') is not None:
+            track.depth_history.append((now, finger['depth_diff']))
+
+        if not track.touching:
+            track.enter_count = track.enter_count + 1 if pressed else 0
+            if track.enter_count >= self.min_down_frames and track.a4_coord:
+                track.touching = True
+                track.exit_count = 0
+                if track.provisional:
+                    track.provisional = False
+                    return [self._emit("touch_confirm", track, now)]
+                return [self._emit("touch_down", track, now, provisional=False)]
+
+            if track.provisional:
+                velocity = self._approach_velocity(track)
+                if released or now - track.provisional_at > self.prediction_timeout or \
+                        (velocity is not None and velocity > 0):
+                    track.provisional = False
+                    return [self._emit("touch_cancel", track, now)]
+                return []
+
+            if track.predictive and track.a4_coord and self._predict_contact(track):
+                track.provisional = True
+                track.provisional_at = now
+                return [self._emit("touch_down", track, now, provisional=True)]
+            return []
+
+        track.exit_count = track.exit_count + 1 if released else 0
+        if track.exit_count >= self.min_up_frames:
+            track.touching = False
+            track.enter_count = 0
+            return [self._emit("touch_up", track, now)]
+        if moved and track.a4_coord:
+            return [self._emit("touch_move", track, now)]
+        return []
+
+    def update(self, fingers, now, roi_lookup=None):
+        """更新一幀並回傳本幀產生的事件"""
+        new_events = []
+
+        with self._lock:
+            matches = self._match(fingers)
+            seen = set()
+
+            for i, finger in enumerate(fingers):
+                track_id = matches.get(i)
+                if track_id is None:
+                    track = FingerTrack(next(self._ids), finger['position'], finger.get('a4_coord'),
+                                        self.history_size)
+                    self.tracks[track.finger_id] = track
+                else:
+                    track = self.tracks[track_id]
+                seen.add(track.finger_id)
+
+                moved = finger.get('a4_coord') != track.a4_coord
+                track.position = finger['position']
+                track.a4_coord = finger.get('a4_coord')
+                track.missed_frames = 0
+
+                roi = roi_lookup(track.a4_coord) if roi_lookup and track.a4_coord else None
+                track.roi = {
+                    "id": roi['id'],
+                    "name": roi.get('name'),
+                    "audio_file": roi.get('audio_file')
+                } if roi else None
+                track.predictive = bool(roi and roi.get('predictive'))
+
+                new_events.extend(self._step(track, finger, moved, now))
+
+                finger['finger_id'] = track.finger_id
+                finger['touching'] = track.touching
+
+            # 消失的指尖：超過容忍幀數即結束
+            for track_id in list(self.tracks):
+                track = self.tracks[track_id]
+                if track_id in seen:
+                    continue
+                track.missed_frames += 1
+                if track.missed_frames > self.max_missed_frames:
+                    if track.touching:
+                        track.touching = False
+                        new_events.append(self._emit("touch_up", track, now))
+                    elif track.provisional:
+                        new_events.append(self._emit("touch_cancel", track, now))
+                    del self.tracks[track_id]
+
+        return new_events
+
+    def touching_tracks(self):
+        """目前處於接觸狀態的指尖"""
+        with self._lock:
+            return [track for track in self.tracks.values() if track.touching]
+
+    def events_since(self, seq):
+        """取得序號之後的事件 (供輪詢使用)"""
+        with self._lock:
+            return [event for event in self.events if event["seq"] > seq]
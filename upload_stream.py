@@ -0,0 +1,149 @@
+# upload_stream.py - 上傳串流寫入模組
+import hashlib
+import os
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+# 各類型上傳大小上限 (位元組)，可由 app.config['UPLOAD_LIMITS'] 覆寫
+DEFAULT_UPLOAD_LIMITS = {
+    'image': 25 * 1024 * 1024,
+    'audio': 50 * 1024 * 1024
+}
+
+SNIFF_BYTES = 16
+
+
+def sniff(header):
+    """依檔頭判斷檔案類型，回傳 (類型, 副檔名)，無法辨識時回傳 (None, None)"""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image', '.png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image', '.jpg'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image', '.gif'
+    if header.startswith(b'BM'):
+        return 'image', '.bmp'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'image', '.webp'
+    if header.startswith(b'RIFF') and header[8:12] == b'WAVE':
+        return 'audio', '.wav'
+    if header.startswith(b'OggS'):
+        return 'audio', '.ogg'
+    if header.startswith(b'ID3') or (len(header) > 1 and header[0] == 0xff and header[1] & 0xe0 == 0xe0):
+        return 'audio', '.mp3'
+    if header[4:8] == b'ftyp' and header[8:11] in (b'M4A', b'mp4', b'iso'):
+        return 'audio', '.m4a'
+    return None, None
+
+
+class HashingUpload:
+    """上傳檔案直接分塊寫入暫存檔，同時計算 SHA-256 並由檔頭判斷類型
+
+    類型確定後即檢查該類型的大小上限，超過時立即中止 (413) 並刪除暫存檔。
+    finish() 後暫存檔可直接 rename 到素材庫；未交出的暫存檔在 close 時刪除。
+    """
+
+    def __init__(self, path, limits):
+        self.path = path
+        self.limits = limits
+        self.size = 0
+        self.kind = None
+        self.ext = None
+        self._header = b''
+        self._sha256 = hashlib.sha256()
+        self._file = open(path, 'w+b')
+
+    def _sniff(self):
+        self.kind, self.ext = sniff(self._header)
+        if self.kind is None:
+            self.discard()
+            raise UnsupportedMediaType('不支援的檔案格式')
+
+    def write(self, data):
+        if self.kind is None:
+            self._header += data[:SNIFF_BYTES - len(self._header)]
+            if len(self._header) >= SNIFF_BYTES:
+                self._sniff()
+
+        self.size += len(data)
+        if self.kind is not None and self.size > self.limits[self.kind]:
+            self.discard()
+            raise RequestEntityTooLarge(f'檔案超過 {self.limits[self.kind] // (1024 * 1024)} MB')
+
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def finish(self):
+        """寫入磁碟並關閉，之後可交給素材庫"""
+        if self.kind is None:
+            self._sniff()
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        self.discard()
+
+    # 供 FileStorage 讀取 (例如未經素材庫的 save())
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+
+class UploadRequest(Request):
+    """multipart 檔案直接串流寫入素材庫暫存資料夾 (UPLOAD_TEMP_FOLDER)
+
+    請求中建立的暫存檔都會記錄下來，請求結束 (close) 時刪除未交給素材庫的檔案，
+    解析中途被拒絕或連線中斷時也不會留下暫存檔。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._uploads = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        temp_folder = current_app.config.get('UPLOAD_TEMP_FOLDER')
+        if not temp_folder:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+        limits = dict(DEFAULT_UPLOAD_LIMITS, **current_app.config.get('UPLOAD_LIMITS', {}))
+        if content_length and content_length > max(limits.values()):
+            raise RequestEntityTooLarge()
+        name = f"{os.getpid()}_{os.urandom(8).hex()}.upload.tmp"
+        upload = HashingUpload(os.path.join(temp_folder, name), limits)
+        self._uploads.append(upload)
+        return upload
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for upload in self._uploads:
+                upload.discard()
+            self._uploads = []